@@ -4,10 +4,17 @@ import re
 
 from .database import Database
 from .services.deezer_data import DeezerDataClient
+from .services.metadata_cache import MetadataCache
+from .services.artist_index import ArtistIndex
+from .services.scanner import LibraryScanner
+from .services.library_index import LibraryIndex
+from .services.library_watcher import LibraryWatcher
 from .services.downloader import Downloader
 from .routes import main_bp, start_queue_worker
 from .services.deezer import DeezerClient as DeezerExplorer
 from .services.logger import sys_logger
+from .services.scheduler import DailyScheduler
+from .services.spider import SpiderPreview
 
 
 def get_changelog_summary(version_tag):
@@ -57,7 +64,7 @@ def create_app():
     db = Database("/config/melodock.db")
     db.init_db()
 
-    metadata = DeezerDataClient()
+    metadata = DeezerDataClient(cache=MetadataCache("/config/metadata_cache.db"))
 
     # Downloader aplica patch do deemix no __init__
     downloader = Downloader(db)
@@ -68,6 +75,11 @@ def create_app():
     app.config['METADATA'] = metadata
     app.config['DOWNLOADER'] = downloader
     app.config['EXPLORER'] = explorer
+    app.config['ARTIST_INDEX'] = ArtistIndex(db, metadata)
+    library = LibraryIndex(db)
+    app.config['LIBRARY'] = library
+    app.config['SCANNER'] = LibraryScanner(metadata, db, library)
+    app.config['SPIDER_PREVIEW'] = SpiderPreview(db, metadata, downloader)
 
     @app.context_processor
     def inject_vars():
@@ -79,5 +91,8 @@ def create_app():
     app.register_blueprint(main_bp)
 
     start_queue_worker(app)
+    DailyScheduler(db, metadata, downloader, library).start()
+    if db.settings.get('library_watch'):
+        LibraryWatcher(db, library, metadata, downloader).start()
 
     return app
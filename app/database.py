@@ -1,61 +1,571 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
 import os
+from .services.logger import sys_logger
+from .services.settings import SettingsService
 
 class Database:
+    # PRAGMAs aplicados uma vez por conexão (cada thread mantém a sua)
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-20000",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA temp_store=MEMORY",
+    )
+
     def __init__(self, db_path):
         self.db_path = db_path
+        self._local = threading.local()
+        self.settings = SettingsService(self)
+        # Filtro novo: álbuns barrados pelo antigo precisam ser avaliados de novo
+        self.settings.subscribe(lambda key, value: self.recheck_rejected_albums(), keys=['ignored_keywords', 'max_tracks'])
         self._ensure_directory()
 
     def _ensure_directory(self):
         d = os.path.dirname(self.db_path)
         if not os.path.exists(d): os.makedirs(d, exist_ok=True)
 
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0, cached_statements=256)
         conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def get_connection(self):
+        """
+        Conexão persistente da thread atual.
+        Com WAL, leitores (dashboard) não bloqueiam atrás das escritas do worker.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
         return conn
 
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- MIGRAÇÕES (PRAGMA user_version) ---
+    # Cada entrada leva o schema da versão N-1 para a versão N.
+    # Nunca editar uma migração já publicada: sempre adicionar uma nova no fim.
+
+    def _column_exists(self, conn, table, column):
+        return any(r['name'] == column for r in conn.execute(f"PRAGMA table_info({table})"))
+
+    def _migration_1_base_schema(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''')
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS artists (
+            deezer_id TEXT PRIMARY KEY,
+            name TEXT,
+            genre TEXT,
+            image_url TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_sync TIMESTAMP
+        )''')
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, deezer_id TEXT, title TEXT, artist TEXT, type TEXT, status TEXT DEFAULT 'pending', error_msg TEXT, cover_url TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS tracks (id INTEGER PRIMARY KEY AUTOINCREMENT, queue_id INTEGER, deezer_id TEXT, title TEXT, artist TEXT, track_number INTEGER, status TEXT DEFAULT 'pending', manual_url TEXT, duration INTEGER DEFAULT 0, FOREIGN KEY(queue_id) REFERENCES queue(id) ON DELETE CASCADE)''')
+
+        # Bancos antigos (pré-migrações) podem não ter essas colunas
+        if not self._column_exists(conn, 'tracks', 'deezer_id'):
+            conn.execute("ALTER TABLE tracks ADD COLUMN deezer_id TEXT")
+        if not self._column_exists(conn, 'artists', 'image_url'):
+            conn.execute("ALTER TABLE artists ADD COLUMN image_url TEXT")
+
+    def _migration_2_hot_indexes(self, conn):
+        # Remove álbuns duplicados antes do índice único (mantém o 'completed' ou o mais antigo)
+        dup_filter = '''
+            deezer_id IS NOT NULL AND id != (
+                SELECT q2.id FROM queue q2 WHERE q2.deezer_id = queue.deezer_id
+                ORDER BY (q2.status = 'completed') DESC, q2.id ASC LIMIT 1
+            )'''
+        conn.execute(f"DELETE FROM tracks WHERE queue_id IN (SELECT id FROM queue WHERE {dup_filter})")
+        conn.execute(f"DELETE FROM queue WHERE {dup_filter}")
+
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_queue_deezer_id ON queue(deezer_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_status_artist ON queue(status, artist)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_artist ON queue(artist)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_queue_status ON tracks(queue_id, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_artists_name ON artists(name)")
+
+    def _migration_3_unique_album_tracks(self, conn):
+        # Permite INSERT ... ON CONFLICT nas faixas (uma faixa por álbum)
+        conn.execute('''DELETE FROM tracks WHERE deezer_id IS NOT NULL AND id != (
+            SELECT t2.id FROM tracks t2 WHERE t2.queue_id = tracks.queue_id AND t2.deezer_id = tracks.deezer_id
+            ORDER BY (t2.status = 'completed') DESC, t2.id ASC LIMIT 1
+        )''')
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tracks_queue_deezer_id ON tracks(queue_id, deezer_id)")
+
+    # Status de álbum com contador próprio em artist_stats / counters
+    QUEUE_STATUSES = ('pending', 'high_priority', 'downloading', 'error', 'completed')
+
+    def _migration_4_status_summary(self, conn):
+        # Resumo por artista (dashboard) + contadores globais, mantidos por triggers
+        cols = ", ".join(f"{st} INTEGER NOT NULL DEFAULT 0" for st in self.QUEUE_STATUSES)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS artist_stats (artist TEXT PRIMARY KEY, {cols})")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_artists_added_at ON artists(added_at)")
+
+        def bump(row, sign):
+            sets = ", ".join(f"{st} = {st} {sign} ({row}.status = '{st}')" for st in self.QUEUE_STATUSES)
+            return f'''
+                INSERT OR IGNORE INTO artist_stats (artist) VALUES (COALESCE({row}.artist, ''));
+                UPDATE artist_stats SET {sets} WHERE artist = COALESCE({row}.artist, '');
+                INSERT OR IGNORE INTO counters (name) VALUES ('queue:' || COALESCE({row}.status, ''));
+                UPDATE counters SET value = value {sign} 1 WHERE name = 'queue:' || COALESCE({row}.status, '');'''
+
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_queue_stats_ins AFTER INSERT ON queue BEGIN {bump('NEW', '+')} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_queue_stats_del AFTER DELETE ON queue BEGIN {bump('OLD', '-')} END")
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_queue_stats_upd AFTER UPDATE OF status, artist ON queue
+            WHEN OLD.status IS NOT NEW.status OR OLD.artist IS NOT NEW.artist
+            BEGIN {bump('OLD', '-')} {bump('NEW', '+')} END''')
+
+        conn.execute("INSERT OR IGNORE INTO counters (name) VALUES ('artists')")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS trg_artists_count_ins AFTER INSERT ON artists BEGIN UPDATE counters SET value = value + 1 WHERE name = 'artists'; END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS trg_artists_count_del AFTER DELETE ON artists BEGIN UPDATE counters SET value = value - 1 WHERE name = 'artists'; END")
+
+        self._rebuild_stats(conn)
+
+    def _rebuild_stats(self, conn):
+        sums = ", ".join(f"SUM(status = '{st}')" for st in self.QUEUE_STATUSES)
+        conn.execute("DELETE FROM artist_stats")
+        conn.execute(f"INSERT INTO artist_stats (artist, {', '.join(self.QUEUE_STATUSES)}) SELECT COALESCE(artist, ''), {sums} FROM queue GROUP BY COALESCE(artist, '')")
+        conn.execute("DELETE FROM counters")
+        conn.execute("INSERT INTO counters (name, value) SELECT 'queue:' || COALESCE(status, ''), COUNT(*) FROM queue GROUP BY COALESCE(status, '')")
+        conn.execute("INSERT INTO counters (name, value) SELECT 'artists', COUNT(*) FROM artists")
+
+    def _migration_5_seen_albums(self, conn):
+        # Marca d'água por artista: álbuns da discografia já avaliados (varredura incremental)
+        conn.execute('''CREATE TABLE IF NOT EXISTS artist_albums_seen (
+            artist_id TEXT NOT NULL,
+            album_id TEXT NOT NULL,
+            PRIMARY KEY (artist_id, album_id)
+        ) WITHOUT ROWID''')
+        conn.execute("CREATE TRIGGER IF NOT EXISTS trg_artists_seen_del AFTER DELETE ON artists BEGIN DELETE FROM artist_albums_seen WHERE artist_id = OLD.deezer_id; END")
+
+        # O que já está na fila conta como visto; o resto entra na primeira varredura
+        conn.execute('''INSERT OR IGNORE INTO artist_albums_seen (artist_id, album_id)
+            SELECT a.deezer_id, q.deezer_id FROM queue q JOIN artists a ON a.name = q.artist
+            WHERE q.deezer_id IS NOT NULL''')
+
+    def _migration_6_scheduler_state(self, conn):
+        # Última execução de cada job agendado (sobrevive a reinícios)
+        conn.execute('''CREATE TABLE IF NOT EXISTS scheduler_state (
+            job TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+    def _migration_7_spider_graph(self, conn):
+        # Grafo de "relacionados" persistido: arestas, nós já expandidos e fronteira priorizada
+        conn.execute('''CREATE TABLE IF NOT EXISTS spider_edges (
+            source_id TEXT NOT NULL,
+            target_id TEXT NOT NULL,
+            PRIMARY KEY (source_id, target_id)
+        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_spider_edges_target ON spider_edges(target_id)")
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS spider_visited (
+            deezer_id TEXT PRIMARY KEY,
+            expanded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS spider_frontier (
+            deezer_id TEXT PRIMARY KEY,
+            name TEXT,
+            fans INTEGER NOT NULL DEFAULT 0,
+            image_url TEXT,
+            inbound INTEGER NOT NULL DEFAULT 0,
+            score REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            reason TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_spider_frontier_status_score ON spider_frontier(status, score)")
+
+    def _migration_8_artist_search_index(self, conn):
+        # Índice local da busca (biblioteca + resultados já vistos do Deezer), ver ArtistIndex
+        conn.execute('''CREATE TABLE IF NOT EXISTS search_artists (
+            deezer_id TEXT PRIMARY KEY,
+            name TEXT,
+            fans INTEGER NOT NULL DEFAULT 0,
+            image_url TEXT,
+            in_library INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        # Uma linha por palavra normalizada do nome: busca por prefixo = faixa no índice
+        conn.execute('''CREATE TABLE IF NOT EXISTS search_terms (
+            term TEXT NOT NULL,
+            deezer_id TEXT NOT NULL,
+            PRIMARY KEY (term, deezer_id)
+        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_search_terms_artist ON search_terms(deezer_id)")
+
+    def _migration_9_folder_resolutions(self, conn):
+        # Cache do scan de /music: pasta -> artista do Deezer, válido enquanto o mtime da pasta não mudar
+        conn.execute('''CREATE TABLE IF NOT EXISTS folder_resolutions (
+            folder TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            status TEXT NOT NULL,
+            deezer_id TEXT,
+            name TEXT,
+            image_url TEXT,
+            resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+    def _migration_10_library_index(self, conn):
+        # Índice persistente de /music (ver LibraryIndex): uma linha por pasta de artista e de álbum
+        conn.execute('''CREATE TABLE IF NOT EXISTS library_dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT NOT NULL,
+            name TEXT NOT NULL,
+            inode INTEGER,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            track_count INTEGER NOT NULL DEFAULT 0,
+            audio_format TEXT,
+            image TEXT,
+            indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_library_dirs_parent ON library_dirs(parent)")
+
+    def _migration_11_track_files(self, conn):
+        # Vínculo faixa -> arquivo (TrackLinker) e ISRC do Deezer para casar pelas tags
+        if not self._column_exists(conn, 'tracks', 'isrc'):
+            conn.execute("ALTER TABLE tracks ADD COLUMN isrc TEXT")
+        if not self._column_exists(conn, 'tracks', 'file_path'):
+            conn.execute("ALTER TABLE tracks ADD COLUMN file_path TEXT")
+        # Tags lidas dos arquivos de /music, válidas enquanto mtime e tamanho não mudarem
+        conn.execute('''CREATE TABLE IF NOT EXISTS file_tags (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            title TEXT,
+            album TEXT,
+            track_number INTEGER,
+            duration INTEGER,
+            isrc TEXT,
+            deezer_id TEXT,
+            read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+
+    def _migration_12_drop_scan_time(self, conn):
+        # A varredura de lançamentos roda em fatias ao longo do dia: o horário único não é mais usado
+        conn.execute("DELETE FROM settings WHERE key='scan_time'")
+
+    def _migration_13_seen_rejections(self, conn):
+        # Marca d'água guarda o motivo de álbuns barrados pelo filtro: mudar o filtro só reavalia esses
+        if not self._column_exists(conn, 'artist_albums_seen', 'rejected'):
+            conn.execute("ALTER TABLE artist_albums_seen ADD COLUMN rejected TEXT")
+        if not self._column_exists(conn, 'artist_albums_seen', 'recheck'):
+            conn.execute("ALTER TABLE artist_albums_seen ADD COLUMN recheck INTEGER NOT NULL DEFAULT 0")
+
+    def _migration_14_requeue_low_fan_candidates(self, conn):
+        # Rejeição por poucos fãs deixou de ser gravada: volta para a fronteira (vale o spider_min_fans atual)
+        conn.execute("UPDATE spider_frontier SET status='queued', reason=NULL WHERE status='rejected' AND reason='poucos fãs'")
+
+    MIGRATIONS = (
+        _migration_1_base_schema,
+        _migration_2_hot_indexes,
+        _migration_3_unique_album_tracks,
+        _migration_4_status_summary,
+        _migration_5_seen_albums,
+        _migration_6_scheduler_state,
+        _migration_7_spider_graph,
+        _migration_8_artist_search_index,
+        _migration_9_folder_resolutions,
+        _migration_10_library_index,
+        _migration_11_track_files,
+        _migration_12_drop_scan_time,
+        _migration_13_seen_rejections,
+        _migration_14_requeue_low_fan_candidates,
+    )
+
+    # Consultas quentes que nunca podem voltar a ser full scan (ver check_query_plans)
+    HOT_QUERIES = (
+        ("SELECT 1 FROM queue WHERE deezer_id=?", ('0',)),
+        ("SELECT 1 FROM queue WHERE artist=? AND status IN ('pending', 'downloading')", ('',)),
+        ("SELECT 1 FROM queue WHERE artist=? AND status='error'", ('',)),
+        ("SELECT * FROM queue WHERE artist=?", ('',)),
+        ("SELECT * FROM queue WHERE status='pending' ORDER BY id ASC", ()),
+        ("SELECT * FROM tracks WHERE queue_id=? AND status='pending'", (0,)),
+        ("SELECT count(*) as c FROM tracks WHERE queue_id=? AND status='error'", (0,)),
+        ("SELECT * FROM tracks WHERE queue_id=?", (0,)),
+        ("SELECT * FROM artists WHERE name=?", ('',)),
+        ("SELECT 1 FROM artists WHERE deezer_id=?", ('',)),
+        ("SELECT album_id FROM artist_albums_seen WHERE artist_id=? AND recheck=0", ('',)),
+        ("SELECT album_id FROM artist_albums_seen WHERE artist_id=? AND recheck=1", ('',)),
+        ("SELECT * FROM spider_frontier WHERE status='queued' AND (score < ? OR (score = ? AND deezer_id > ?)) ORDER BY score DESC, deezer_id ASC LIMIT 50", (0, 0, '')),
+        ("SELECT target_id, COUNT(*) as c FROM spider_edges WHERE target_id IN (?) GROUP BY target_id", ('',)),
+        ("SELECT DISTINCT deezer_id FROM search_terms WHERE term >= ? AND term < ?", ('', '')),
+        ("SELECT * FROM library_dirs WHERE parent=? ORDER BY name", ('',)),
+        ("SELECT a.*, s.pending FROM artists a LEFT JOIN artist_stats s ON s.artist = a.name ORDER BY a.added_at DESC LIMIT 30", ()),
+        ("SELECT a.*, s.pending FROM artists a LEFT JOIN artist_stats s ON s.artist = a.name ORDER BY a.name ASC LIMIT 30", ()),
+    )
+
+    def migrate(self):
+        conn = self.get_connection()
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        target = len(self.MIGRATIONS)
+        if current >= target:
+            return current
+
+        for version in range(current + 1, target + 1):
+            migration = self.MIGRATIONS[version - 1]
+            with self.transaction():
+                # Outra thread/processo pode ter migrado enquanto esperávamos o lock
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                    continue
+                migration(self, conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+            sys_logger.log("SYSTEM", f"🗄️ Migração de banco aplicada: v{version} ({migration.__name__})")
+
+        conn.execute("ANALYZE")
+        conn.commit()
+        return target
+
+    def check_query_plans(self):
+        """
+        Retorna as consultas quentes cujo plano virou full scan (lista vazia = tudo indexado).
+        Roda sobre um schema limpo em memória para não depender das estatísticas do ANALYZE.
+        """
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        try:
+            for migration in self.MIGRATIONS:
+                migration(self, conn)
+            regressions = []
+            for sql, args in self.HOT_QUERIES:
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", args).fetchall()
+                # SCAN via índice (ORDER BY ... LIMIT) é ok; SCAN da tabela crua não
+                scans = [row['detail'] for row in plan if row['detail'].startswith('SCAN') and ' USING ' not in row['detail']]
+                if scans:
+                    regressions.append((sql, scans))
+            return regressions
+        finally:
+            conn.close()
+
     def init_db(self):
+        self.migrate()
+
+        for sql, scans in self.check_query_plans():
+            sys_logger.log("ERROR", f"⚠️ Consulta sem índice ({'; '.join(scans)}): {sql}")
+
         with self.get_connection() as conn:
-            conn.execute('''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''')
-
-            conn.execute('''CREATE TABLE IF NOT EXISTS artists (
-                deezer_id TEXT PRIMARY KEY, 
-                name TEXT, 
-                genre TEXT, 
-                image_url TEXT, 
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_sync TIMESTAMP
-            )''')
-            
-            conn.execute('''CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, deezer_id TEXT, title TEXT, artist TEXT, type TEXT, status TEXT DEFAULT 'pending', error_msg TEXT, cover_url TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            conn.execute('''CREATE TABLE IF NOT EXISTS tracks (id INTEGER PRIMARY KEY AUTOINCREMENT, queue_id INTEGER, deezer_id TEXT, title TEXT, artist TEXT, track_number INTEGER, status TEXT DEFAULT 'pending', manual_url TEXT, duration INTEGER DEFAULT 0, FOREIGN KEY(queue_id) REFERENCES queue(id) ON DELETE CASCADE)''')
-
-            try: conn.execute("ALTER TABLE tracks ADD COLUMN deezer_id TEXT")
-            except: pass
-            try: conn.execute("ALTER TABLE artists ADD COLUMN image_url TEXT")
-            except: pass
-            
-            conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('scan_time', '03:00')")
             conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('download_quality', '3')")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa várias escritas num único commit (um fsync).
+        Aninhável: blocos internos viram SAVEPOINTs.
+        """
+        conn = self.get_connection()
+        depth = getattr(self._local, 'tx_depth', 0)
+        if depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        else:
+            conn.execute(f"SAVEPOINT sp_{depth}")
+        self._local.tx_depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.tx_depth = depth
+            if depth == 0:
+                conn.rollback()
+            else:
+                conn.execute(f"ROLLBACK TO sp_{depth}")
+                conn.execute(f"RELEASE sp_{depth}")
+            raise
+        self._local.tx_depth = depth
+        if depth == 0:
             conn.commit()
+        else:
+            conn.execute(f"RELEASE sp_{depth}")
+
+    def _in_transaction(self):
+        return getattr(self._local, 'tx_depth', 0) > 0
 
     def query(self, sql, args=(), one=False):
-        with self.get_connection() as conn:
-            cur = conn.execute(sql, args)
-            rv = cur.fetchall()
-            return (rv[0] if rv else None) if one else rv
+        conn = self.get_connection()
+        cur = conn.execute(sql, args)
+        rv = cur.fetchall()
+        return (rv[0] if rv else None) if one else rv
 
     def execute(self, sql, args=()):
-        with self.get_connection() as conn:
+        if self._in_transaction():
+            return self.get_connection().execute(sql, args)
+        conn = self.get_connection()
+        try:
             cur = conn.execute(sql, args)
             conn.commit()
             return cur
+        except Exception:
+            conn.rollback()
+            raise
 
-    def get_setting(self, key):
-        r = self.query("SELECT value FROM settings WHERE key=?", (key,), one=True)
+    def executemany(self, sql, seq_of_args):
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_args)
+
+    # --- INGESTÃO EM LOTE ---
+
+    def _existing_ids(self, table, deezer_ids):
+        ids = list({str(i) for i in deezer_ids if i})
+        found = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.query(f"SELECT deezer_id FROM {table} WHERE deezer_id IN ({marks})", chunk)
+            found.update(r['deezer_id'] for r in rows)
+        return found
+
+    def existing_album_ids(self, deezer_ids):
+        """Quais desses álbuns já estão na fila (uma consulta por lote, não por álbum)."""
+        return self._existing_ids("queue", deezer_ids)
+
+    def existing_artist_ids(self, deezer_ids):
+        """Quais desses artistas já estão na biblioteca (uma consulta por lote)."""
+        return self._existing_ids("artists", deezer_ids)
+
+    def add_tracks(self, queue_id, tracks, status='pending'):
+        """Upsert das faixas de um álbum; faixas já existentes (mesmo deezer_id) são mantidas."""
+        return self.executemany(
+            """INSERT INTO tracks (queue_id, deezer_id, title, artist, track_number, duration, isrc, status)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(queue_id, deezer_id) DO NOTHING""",
+            [
+                (queue_id, t.get('deezer_id'), t.get('title'), t.get('artist'),
+                 t.get('track_num'), t.get('duration') or 0, t.get('isrc') or None, status)
+                for t in tracks
+            ]
+        )
+
+    def add_album(self, album, artist, tracks, status='pending'):
+        """
+        Insere o álbum e todas as faixas numa única transação.
+        Retorna o queue_id, ou None se o álbum já estava na fila.
+        """
+        with self.transaction():
+            cur = self.execute(
+                """INSERT INTO queue (deezer_id, title, artist, type, status, cover_url)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(deezer_id) DO NOTHING""",
+                (album['deezer_id'], album['title'], artist, album.get('type') or 'album', status, album.get('cover'))
+            )
+            if cur.rowcount != 1:
+                return None
+            qid = cur.lastrowid
+            self.add_tracks(qid, tracks, status=status)
+            return qid
+
+    def upsert_artist(self, deezer_id, name, image_url=None, genre=None):
+        """Cria ou atualiza o artista sem REPLACE (preserva added_at e não dispara DELETE)."""
+        return self.execute(
+            """INSERT INTO artists (deezer_id, name, genre, image_url, last_sync)
+               VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT(deezer_id) DO UPDATE SET
+                   name = excluded.name,
+                   genre = COALESCE(excluded.genre, artists.genre),
+                   image_url = COALESCE(excluded.image_url, artists.image_url),
+                   last_sync = CURRENT_TIMESTAMP""",
+            (deezer_id, name, genre, image_url)
+        )
+
+    def purge_filtered(self, album_filter, statuses=('pending', 'high_priority', 'error')):
+        """
+        Remove da fila (em lote, sem laço por álbum) o que as regras atuais
+        rejeitam. As regras rodam como função SQL; retorna quantos álbuns saíram.
+        """
+        marks = ",".join("?" * len(statuses))
+        with self.transaction() as conn:
+            conn.create_function("album_rejected", 3, album_filter.rejects_sql, deterministic=True)
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS purge_ids (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM purge_ids")
+            conn.execute(f'''INSERT INTO purge_ids (id)
+                SELECT q.id FROM queue q
+                WHERE q.status IN ({marks})
+                  AND album_rejected(q.title, q.type, (SELECT COUNT(*) FROM tracks t WHERE t.queue_id = q.id))''',
+                statuses)
+            conn.execute("DELETE FROM tracks WHERE queue_id IN (SELECT id FROM purge_ids)")
+            removed = conn.execute("DELETE FROM queue WHERE id IN (SELECT id FROM purge_ids)").rowcount
+            conn.execute("DELETE FROM purge_ids")
+        return removed
+
+    # --- VARREDURA INCREMENTAL ---
+
+    def seen_album_ids(self, artist_id):
+        rows = self.query("SELECT album_id FROM artist_albums_seen WHERE artist_id=? AND recheck=0", (str(artist_id),))
+        return {r['album_id'] for r in rows}
+
+    def recheck_album_ids(self, artist_id):
+        """Álbuns barrados por um filtro que mudou desde então: a próxima varredura os avalia de novo."""
+        rows = self.query("SELECT album_id FROM artist_albums_seen WHERE artist_id=? AND recheck=1", (str(artist_id),))
+        return {r['album_id'] for r in rows}
+
+    def mark_albums_seen(self, artist_id, album_ids, rejected=None):
+        """rejected: {album_id: motivo} dos que o filtro barrou (os demais ficam com rejected NULL)."""
+        artist_id = str(artist_id)
+        rejected = rejected or {}
+        return self.executemany(
+            """INSERT INTO artist_albums_seen (artist_id, album_id, rejected) VALUES (?, ?, ?)
+               ON CONFLICT(artist_id, album_id) DO UPDATE SET rejected = excluded.rejected, recheck = 0""",
+            [(artist_id, str(aid), rejected.get(str(aid))) for aid in album_ids]
+        )
+
+    def forget_albums_seen(self, artist_id, album_ids):
+        return self.executemany("DELETE FROM artist_albums_seen WHERE artist_id=? AND album_id=?",
+                                [(str(artist_id), str(aid)) for aid in album_ids])
+
+    def recheck_rejected_albums(self):
+        """Filtro mudou: só os álbuns que ele barrou voltam a ser avaliados (o resto da marca d'água fica)."""
+        marked = self.execute("UPDATE artist_albums_seen SET recheck=1 WHERE rejected IS NOT NULL AND recheck=0").rowcount
+        if marked:
+            sys_logger.log("SYSTEM", f"🔄 Filtro de álbuns alterado: {marked} álbuns barrados serão reavaliados.")
+        return marked
+
+    # --- AGENDADOR ---
+
+    def get_job_state(self, job):
+        r = self.query("SELECT value FROM scheduler_state WHERE job=?", (job,), one=True)
         return r['value'] if r else None
 
+    def set_job_state(self, job, value):
+        return self.execute(
+            """INSERT INTO scheduler_state (job, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+               ON CONFLICT(job) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP""",
+            (job, str(value))
+        )
+
+    # --- RESUMO / CONTADORES ---
+
+    def get_counter(self, name):
+        r = self.query("SELECT value FROM counters WHERE name=?", (name,), one=True)
+        return r['value'] if r else 0
+
+    def count_queue(self, *statuses):
+        """Total de álbuns nesses status, lido dos contadores (O(1), sem varrer a fila)."""
+        marks = ",".join("?" * len(statuses))
+        r = self.query(f"SELECT COALESCE(SUM(value), 0) as c FROM counters WHERE name IN ({marks})",
+                       tuple(f"queue:{st}" for st in statuses), one=True)
+        return r['c']
+
+    def rebuild_stats(self):
+        """Recalcula resumo e contadores do zero (reparo manual caso saiam de sincronia)."""
+        with self.transaction() as conn:
+            self._rebuild_stats(conn)
+
+    # Configurações passam pelo cache (SettingsService); valores tipados em db.settings.get()
+    def get_setting(self, key):
+        return self.settings.get_raw(key)
+
     def set_setting(self, key, value):
-        self.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
\ No newline at end of file
+        self.settings.set(key, value)
@@ -1,15 +1,16 @@
 from flask import Blueprint, render_template, request, redirect, url_for, current_app, jsonify, send_file
 from .services.logger import sys_logger
 from collections import defaultdict
-from difflib import SequenceMatcher
 from .services.maintenance import LibraryMaintenance
+from .services.album_matcher import AlbumMatcher
+from .services.track_linker import TrackLinker
+from .services.deezer_http import DeezerAPIError
 from datetime import datetime
 import threading
 import os
 import shutil
 import math
 import time
-import re
 
 
 main_bp = Blueprint('main', __name__)
@@ -17,6 +18,8 @@ main_bp = Blueprint('main', __name__)
 def get_db(): return current_app.config['DB']
 def get_meta(): return current_app.config['METADATA']
 def get_dl(): return current_app.config['DOWNLOADER']
+def get_index(): return current_app.config['ARTIST_INDEX']
+def get_library(): return current_app.config['LIBRARY']
 
 
 @main_bp.route('/')
@@ -28,9 +31,9 @@ def index():
 def dashboard():
     db = get_db()
     stats = {
-        'artists': db.query("SELECT COUNT(*) as c FROM artists", one=True)['c'],
-        'queue': db.query("SELECT COUNT(*) as c FROM queue WHERE status IN ('pending', 'high_priority', 'downloading')", one=True)['c'],
-        'completed': db.query("SELECT COUNT(*) as c FROM queue WHERE status='completed'", one=True)['c'],
+        'artists': db.get_counter('artists'),
+        'queue': db.count_queue('pending', 'high_priority', 'downloading'),
+        'completed': db.count_queue('completed'),
     }
 
     page = request.args.get('page', 1, type=int)
@@ -40,25 +43,31 @@ def dashboard():
 
     sort = request.args.get('sort', 'date_desc')
     if sort == 'name_asc':
-        order = "ORDER BY name ASC"
+        order = "ORDER BY a.name ASC"
     elif sort == 'name_desc':
-        order = "ORDER BY name DESC"
+        order = "ORDER BY a.name DESC"
     elif sort == 'date_asc':
-        order = "ORDER BY added_at ASC"
+        order = "ORDER BY a.added_at ASC"
     else:
-        order = "ORDER BY added_at DESC"
-
-    artists_raw = db.query(f"SELECT * FROM artists {order} LIMIT ? OFFSET ?", (per_page, offset))
+        order = "ORDER BY a.added_at DESC"
+
+    # Resumo por artista mantido por triggers (artist_stats): uma consulta só, sem N+1
+    artists_raw = db.query(f"""
+        SELECT a.*,
+               COALESCE(s.pending, 0) + COALESCE(s.downloading, 0) as active_count,
+               COALESCE(s.error, 0) as error_count
+        FROM artists a
+        LEFT JOIN artist_stats s ON s.artist = a.name
+        {order} LIMIT ? OFFSET ?
+    """, (per_page, offset))
 
     artists_list = []
     for art in artists_raw:
         a_dict = dict(art)
-        pending = db.query("SELECT 1 FROM queue WHERE artist=? AND status IN ('pending', 'downloading')", (art['name'],), one=True)
-        error = db.query("SELECT 1 FROM queue WHERE artist=? AND status='error'", (art['name'],), one=True)
 
-        if pending:
+        if art['active_count']:
             a_dict['visual_status'] = 'syncing'
-        elif error:
+        elif art['error_count']:
             a_dict['visual_status'] = 'error'
         else:
             a_dict['visual_status'] = 'ok'
@@ -103,6 +112,10 @@ def settings():
                 db.set_setting('deezer_arl', request.form.get('deezer_arl').strip())
             if request.form.get('download_quality'): 
                 db.set_setting('download_quality', request.form.get('download_quality'))
+            if request.form.get('download_workers'):
+                db.set_setting('download_workers', request.form.get('download_workers'))
+            if request.form.get('download_mode'):
+                db.set_setting('download_mode', request.form.get('download_mode'))
 
         # Salvar Filtros
         if form_type == 'filters' or request.form.get('ignored_keywords'):
@@ -122,6 +135,10 @@ def settings():
             if request.form.get('spider_min_fans'): 
                 db.set_setting('spider_min_fans', request.form.get('spider_min_fans'))
 
+        # Monitoramento de /music
+        if form_type == 'library':
+            db.set_setting('library_watch', 'true' if request.form.get('library_watch') == 'true' else 'false')
+
         sys_logger.log("CONFIG", "Configurações Salvas.")
         return redirect('/settings')
 
@@ -129,25 +146,28 @@ def settings():
         'settings.html',
         deezer_arl=db.get_setting('deezer_arl') or "",
         download_quality=db.get_setting('download_quality') or "3",
+        download_workers=db.get_setting('download_workers') or "1",
+        download_mode=db.get_setting('download_mode') or "album",
+        max_download_workers=MAX_DOWNLOAD_WORKERS,
         ignored_keywords=db.get_setting('ignored_keywords') or "",
         max_tracks=db.get_setting('max_tracks') or "40",
-        scan_time=db.get_setting('scan_time') or "03:00",
         # Vars do Spider
         spider_enabled=db.get_setting('spider_enabled') or "false",
         spider_growth=db.get_setting('spider_growth_percent') or "20",
-        spider_min_fans=db.get_setting('spider_min_fans') or "5000"
+        spider_min_fans=db.get_setting('spider_min_fans') or "5000",
+        library_watch=db.get_setting('library_watch') or "false"
     )
 
 
 # --- SYNC ---
-def background_sync(app):
+def background_sync(app, full=False):
     with app.app_context():
-        sys_logger.log("SYNC", "🔄 Sincronizando biblioteca...")
+        sys_logger.log("SYNC", f"🔄 Sincronizando biblioteca{' (completa)' if full else ''}...")
         db = get_db()
         artists = db.query("SELECT * FROM artists")
         for art in artists:
             try:
-                background_add(app, art['deezer_id'], art['name'])
+                background_add(app, art['deezer_id'], art['name'], full=full)
             except:
                 pass
         sys_logger.log("SYNC", "✅ Sincronização finalizada.")
@@ -156,11 +176,13 @@ def background_sync(app):
 @main_bp.route('/api/sync_library', methods=['POST'])
 def sync_library():
     app_obj = current_app._get_current_object()
-    threading.Thread(target=background_sync, args=(app_obj,)).start()
+    # full=true ignora as marcas d'água e reavalia a discografia inteira
+    full = str(request.values.get('full', '')).lower() == 'true'
+    threading.Thread(target=background_sync, args=(app_obj, full)).start()
     return jsonify({'message': 'Sincronização iniciada.'})
 
 
-def background_add(app, aid, aname):
+def background_add(app, aid, aname, full=False):
     with app.app_context():
         meta = get_meta()
         db = get_db()
@@ -168,18 +190,14 @@ def background_add(app, aid, aname):
 
         sys_logger.log("SYSTEM", f"Processando {aname}...")
 
-        keywords = db.get_setting('ignored_keywords') or ""
-        BLACKLIST = [k.strip().lower() for k in keywords.split(',') if k.strip()]
-        MAX_TRACKS = int(db.get_setting('max_tracks') or 40)
+        # Palavras ignoradas, tipo e limite de faixas, já compilados
+        album_filter = db.settings.album_filter
 
         art_data = meta.get_artist_by_id(aid) if aid else meta.search_artist(aname)
         if not art_data:
             return
 
-        db.execute(
-            "REPLACE INTO artists (deezer_id, name, image_url, last_sync) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-            (art_data['id'], art_data['name'], art_data.get('image'))
-        )
+        db.upsert_artist(art_data['id'], art_data['name'], art_data.get('image'))
 
         # ✅ Nunca quebrar o fluxo por causa de imagem
         try:
@@ -190,31 +208,35 @@ def background_add(app, aid, aname):
         except Exception as e:
             sys_logger.log("ERROR", f"Falha ao salvar imagem (ignorando): {e}")
 
-        albums = meta.get_discography(
-            art_data['id'],
-            target_artist_id=art_data['name'],
-            blacklist=BLACKLIST
-        )
-
+        # Pipeline por página: cada lote filtrado já vai para a fila enquanto
+        # as próximas páginas da discografia ainda estão chegando.
+        # Incremental: só o que ainda não está na marca d'água do artista.
+        seen = set() if full else db.seen_album_ids(art_data['id'])
+        recheck = set() if full else db.recheck_album_ids(art_data['id'])
+        before = set(seen)
+        failed = set()
+        rejected = {}
         cnt = 0
-        for alb in albums:
-            if alb.get('track_count', 0) > MAX_TRACKS:
-                continue
-
-            if not db.query("SELECT 1 FROM queue WHERE deezer_id=?", (alb['deezer_id'],), one=True):
-                cur = db.execute(
-                    "INSERT INTO queue (deezer_id, title, artist, cover_url, status) VALUES (?, ?, ?, ?, 'pending')",
-                    (alb['deezer_id'], alb['title'], art_data['name'], alb.get('cover'))
-                )
-                qid = cur.lastrowid
-                cnt += 1
-
-                tracks = meta.get_album_tracks(alb['deezer_id'], fallback_artist=art_data['name'])
-                for t in tracks:
-                    db.execute(
-                        "INSERT INTO tracks (queue_id, deezer_id, title, artist, track_number) VALUES (?, ?, ?, ?, ?)",
-                        (qid, t.get('deezer_id'), t.get('title'), t.get('artist'), t.get('track_num'))
-                    )
+        try:
+            for page in meta.iter_discography(art_data['id'], target_artist_id=art_data['name'], album_filter=album_filter,
+                                              seen=seen, rejected=rejected, recheck=recheck):
+                known = db.existing_album_ids(alb['deezer_id'] for alb in page)
+                new_albums = [alb for alb in page if alb['deezer_id'] not in known]
+
+                # Sem tracklist não enfileira (tenta no próximo sync)
+                tracklists = meta.get_albums_tracks([alb['deezer_id'] for alb in new_albums], fallback_artist=art_data['name'])
+                for alb in new_albums:
+                    tracks = tracklists.get(alb['deezer_id'])
+                    if tracks is None:
+                        failed.add(alb['deezer_id'])
+                        continue
+                    if db.add_album(alb, art_data['name'], tracks, status='pending'):
+                        cnt += 1
+            db.forget_albums_seen(art_data['id'], recheck)
+        except DeezerAPIError:
+            sys_logger.log("ERROR", f"Discografia de {art_data['name']} incompleta ({cnt} álbuns enfileirados). Tente sincronizar mais tarde.")
+
+        db.mark_albums_seen(art_data['id'], seen - before - failed, rejected)
 
         if cnt > 0:
             sys_logger.log("SUCCESS", f"Found {cnt} new albums for {art_data['name']}.")
@@ -230,70 +252,75 @@ def add_artist():
     return redirect('/downloads')
 
 
-def similar(a, b):
-    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-
-def background_import_existing(app, data):
+def background_import_existing(app, data, use_tags=False):
     with app.app_context():
         meta = get_meta()
         db = get_db()
         dl = get_dl()
+        library = get_library()
+        # Modo tags: faixa a faixa pelos arquivos, em vez de só pelo nome da pasta
+        linker = TrackLinker(db, library) if use_tags else None
 
-        sys_logger.log("IMPORT", "🔄 Importando...")
+        sys_logger.log("IMPORT", f"🔄 Importando{' (conferindo tags)' if use_tags else ''}...")
         count = 0
 
-        for item in data:
-            deezer_id = item.get('deezer_id')
-            if not deezer_id:
-                continue
-
-            art_data = meta.get_artist_by_id(deezer_id)
-            if not art_data:
-                continue
-
-            db.execute(
-                "REPLACE INTO artists (deezer_id, name, image_url, last_sync) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
-                (art_data['id'], art_data['name'], art_data.get('image'))
-            )
-
-            try:
-                if hasattr(dl, "save_artist_image"):
-                    dl.save_artist_image(art_data['name'], art_data.get('image'))
-            except:
-                pass
-
-            albums = meta.get_discography(art_data['id'], target_artist_id=art_data['name'])
-            local_folder = item.get('folder')
-            artist_path = os.path.join("/music", local_folder)
-
-            if os.path.exists(artist_path):
-                local_albums = [d for d in os.listdir(artist_path) if os.path.isdir(os.path.join(artist_path, d))]
-                for alb in albums:
-                    clean_dz = re.sub(r'[^\w\s]', '', alb['title']).lower()
-                    match = False
-
-                    for loc in local_albums:
-                        clean_loc = re.sub(r'[^\w\s]', '', loc).lower()
-                        if similar(clean_dz, clean_loc) > 0.75 or clean_dz in clean_loc:
-                            match = True
-                            break
-
-                    if match:
-                        if not db.query("SELECT 1 FROM queue WHERE deezer_id=?", (alb['deezer_id'],), one=True):
-                            cur = db.execute(
-                                "INSERT INTO queue (deezer_id, title, artist, cover_url, status) VALUES (?, ?, ?, ?, 'completed')",
-                                (alb['deezer_id'], alb['title'], art_data['name'], alb.get('cover'))
-                            )
-                            qid = cur.lastrowid
-
-                            tracks = meta.get_album_tracks(alb['deezer_id'], fallback_artist=art_data['name'])
-                            for t in tracks:
-                                db.execute(
-                                    "INSERT INTO tracks (queue_id, deezer_id, title, artist, track_number, status) VALUES (?, ?, ?, ?, ?, 'completed')",
-                                    (qid, t.get('deezer_id'), t.get('title'), t.get('artist'), t.get('track_num'))
-                                )
-                            count += 1
+        try:
+            for item in data:
+                deezer_id = item.get('deezer_id')
+                if not deezer_id:
+                    continue
+
+                art_data = meta.get_artist_by_id(deezer_id)
+                if not art_data:
+                    continue
+
+                db.upsert_artist(art_data['id'], art_data['name'], art_data.get('image'))
+
+                try:
+                    if hasattr(dl, "save_artist_image"):
+                        dl.save_artist_image(art_data['name'], art_data.get('image'))
+                except:
+                    pass
+
+                try:
+                    albums = meta.get_discography(art_data['id'], target_artist_id=art_data['name'])
+                except DeezerAPIError:
+                    sys_logger.log("IMPORT", f"⚠️ Discografia indisponível: {art_data['name']}")
+                    continue
+                # O scan que gerou `data` acabou de atualizar o índice de /music
+                folder = item.get('folder')
+                local_albums = [row['name'] for row in library.albums(folder)]
+
+                if local_albums:
+                    titles = [alb['title'] for alb in albums]
+                    # Um-para-um: álbuns já conhecidos também disputam as pastas, só não são reinseridos
+                    links = AlbumMatcher(local_albums).match_indices(titles)
+                    if linker:
+                        links = linker.match_renamed(folder, local_albums, titles, links)
+                    known = db.existing_album_ids(alb['deezer_id'] for alb in albums)
+                    matched = [(albums[pos], local_albums[idx]) for pos, idx in sorted(links.items())
+                               if albums[pos]['deezer_id'] not in known]
+
+                    tracklists = meta.get_albums_tracks([alb['deezer_id'] for alb, _ in matched], fallback_artist=art_data['name'])
+                    # Tags de todas as pastas do artista num lote só (pool de processos, cache por mtime)
+                    tags = linker.tags_for([(folder, album_folder) for _, album_folder in matched]) if linker else {}
+                    for alb, album_folder in matched:
+                        tracks = tracklists.get(alb['deezer_id'])
+                        if tracks is None:
+                            continue
+                        # Pasta sem tags legíveis: vale o nome da pasta, como no modo normal
+                        by_tags = bool(linker) and any(t.get('title') for t in tags[(folder, album_folder)].values())
+                        qid = db.add_album(alb, art_data['name'], tracks, status='pending' if by_tags else 'completed')
+                        if not qid:
+                            continue
+                        count += 1
+                        if by_tags:
+                            done, total = linker.link_folder(qid, folder, album_folder)
+                            if done < total:
+                                sys_logger.log("IMPORT", f"⚠️ {alb['title']}: {done}/{total} faixas no disco, o resto vai para a fila.")
+        finally:
+            if linker:
+                linker.close()
 
         sys_logger.log("IMPORT", f"✅ Fim. {count} álbuns vinculados.")
 
@@ -302,14 +329,33 @@ def background_import_existing(app, data):
 def import_library():
     data = request.json
     app_obj = current_app._get_current_object()
-    threading.Thread(target=background_import_existing, args=(app_obj, data)).start()
+    use_tags = request.args.get('mode') == 'tags'
+    threading.Thread(target=background_import_existing, args=(app_obj, data, use_tags)).start()
     return jsonify({'success': True})
 
 
 @main_bp.route('/api/scan_library_preview')
 def scan_library_preview():
-    from .services.scanner import LibraryScanner
-    return jsonify(LibraryScanner(get_meta()).scan_folders())
+    """Scan roda em background: ?start=1 inicia, ?since=N devolve só os resultados que faltam."""
+    scanner = current_app.config['SCANNER']
+    if request.args.get('start'):
+        scanner.start()
+    return jsonify(scanner.status(request.args.get('since', 0, type=int)))
+
+
+@main_bp.route('/api/metadata_cache')
+def metadata_cache_stats():
+    cache = get_meta().cache
+    return jsonify(cache.stats() if cache else {})
+
+
+@main_bp.route('/api/spider_preview')
+def spider_preview():
+    """Simulação do Spider (quanto a fila cresceria, sem gravar nada) em background: ?start=1 inicia."""
+    preview = current_app.config['SPIDER_PREVIEW']
+    if request.args.get('start'):
+        preview.start()
+    return jsonify(preview.status())
 
 
 @main_bp.route('/api/search_live')
@@ -317,7 +363,8 @@ def search_live():
     q = request.args.get('q', '')
     if len(q) < 2:
         return jsonify([])
-    return jsonify(get_meta().find_potential_artists(q))
+    # Índice local (biblioteca + buscas anteriores); Deezer só se faltar resultado
+    return jsonify(get_index().lookup(q))
 
 
 @main_bp.route('/artist_image/<artist_id>')
@@ -336,11 +383,12 @@ def get_image(artist_id):
         if os.path.exists(config_path):
             return send_file(config_path)
 
-        music_path = os.path.join("/music", safe_name)
-        if os.path.exists(music_path):
-            for img in ['folder.jpg', 'cover.jpg', 'artist.jpg', 'fanart.jpg']:
-                if os.path.exists(os.path.join(music_path, img)):
-                    return send_file(os.path.join(music_path, img))
+        local_image = get_library().artist_image(safe_name)
+        if local_image:
+            try:
+                return send_file(local_image)
+            except FileNotFoundError:
+                pass  # apagada depois da última varredura; segue para o Deezer
 
     try:
         meta = get_meta()
@@ -435,23 +483,7 @@ def manage_queue():
         db.execute("UPDATE tracks SET status='pending' WHERE status='downloading'")
         sys_logger.log("USER", "🔄 Destravado.")
     elif action == 'purge_filtered':
-        keywords = db.get_setting('ignored_keywords') or ""
-        blacklist = [k.strip().lower() for k in keywords.split(',') if k.strip()]
-        max_tracks = int(db.get_setting('max_tracks') or 40)
-        pending = db.query("SELECT * FROM queue WHERE status IN ('pending', 'high_priority', 'error')")
-        cnt = 0
-        for alb in pending:
-            should_del = False
-            if any(b in alb['title'].lower() for b in blacklist):
-                should_del = True
-            if not should_del:
-                c = db.query("SELECT COUNT(*) as c FROM tracks WHERE queue_id=?", (alb['id'],), one=True)['c']
-                if c > max_tracks:
-                    should_del = True
-            if should_del:
-                db.execute("DELETE FROM tracks WHERE queue_id=?", (alb['id'],))
-                db.execute("DELETE FROM queue WHERE id=?", (alb['id'],))
-                cnt += 1
+        cnt = db.purge_filtered(db.settings.album_filter)
         sys_logger.log("FILTER", f"Limpeza concluída. {cnt} removidos.")
 
     return jsonify({'success': True})
@@ -470,6 +502,21 @@ def trigger_maintenance():
     return jsonify({'success': True, 'message': 'Manutenção iniciada em background.'})
 
 
+MAX_DOWNLOAD_WORKERS = 4
+
+
 def start_queue_worker(app):
-    from .services.queue import QueueWorker
-    QueueWorker(app.config['DB'], app.config['METADATA'], app.config['DOWNLOADER']).start()
+    from .services.queue import QueueWorker, AlbumRotation
+    db = app.config['DB']
+
+    n_workers = max(1, min(db.settings.get('download_workers'), MAX_DOWNLOAD_WORKERS))
+
+    # Um único índice de rodízio para o pool: nunca dois workers no mesmo artista
+    rotation = AlbumRotation(db)
+    for i in range(n_workers):
+        worker = QueueWorker(db, app.config['METADATA'], app.config['DOWNLOADER'], rotation=rotation, library=app.config['LIBRARY'])
+        worker.name = f"Worker-{i + 1}"
+        worker.start()
+
+    if n_workers > 1:
+        sys_logger.log("WORKER", f"👷 Pool de downloads: {n_workers} workers")
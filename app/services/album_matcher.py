@@ -0,0 +1,81 @@
+from difflib import SequenceMatcher
+from .artist_index import normalize
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AlbumMatcher:
+    """
+    Liga álbuns do Deezer às pastas locais de um artista (importação da biblioteca).
+    Os nomes das pastas são normalizados e indexados por trigramas uma única vez;
+    cada título do Deezer só é comparado com as pastas que compartilham trigramas
+    suficientes com ele. A regra de aceite continua a mesma de antes (semelhança
+    >= 0.75 ou título contido no nome da pasta), mas a atribuição é um-para-um:
+    os pares são ordenados pela semelhança e cada álbum e cada pasta são usados
+    no máximo uma vez.
+    """
+    THRESHOLD = 0.75
+    # Fração mínima dos trigramas do menor nome que precisa existir no outro
+    MIN_SHARED = 0.3
+
+    def __init__(self, folders):
+        self.folders = list(folders)
+        self.norm = [normalize(f) for f in self.folders]
+        self.sizes = []
+        self.postings = {}   # trigrama -> índices das pastas
+        for idx, name in enumerate(self.norm):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for g in grams:
+                self.postings.setdefault(g, []).append(idx)
+
+    def candidates(self, title_norm):
+        """Pastas com trigramas suficientes em comum com o título (já normalizado)."""
+        grams = trigrams(title_norm)
+        shared = {}
+        for g in grams:
+            for idx in self.postings.get(g, ()):
+                shared[idx] = shared.get(idx, 0) + 1
+        return [idx for idx, n in shared.items() if n >= self.MIN_SHARED * min(len(grams), self.sizes[idx])]
+
+    def pairs(self, title_norm):
+        """(semelhança, índice da pasta) de cada pasta aceita para o título."""
+        found = []
+        sm = SequenceMatcher(None)
+        sm.set_seq2(title_norm)   # o SequenceMatcher guarda o pré-processamento do seq2
+        for idx in self.candidates(title_norm):
+            local = self.norm[idx]
+            sm.set_seq1(local)
+            contained = title_norm in local
+            if not contained and (sm.real_quick_ratio() < self.THRESHOLD or sm.quick_ratio() < self.THRESHOLD):
+                continue
+            ratio = sm.ratio()
+            if contained or ratio >= self.THRESHOLD:
+                found.append((ratio, idx))
+        return found
+
+    def match(self, titles):
+        """Recebe os títulos do Deezer e retorna {posição do título: pasta}."""
+        return {pos: self.folders[idx] for pos, idx in self.match_indices(titles).items()}
+
+    def match_indices(self, titles):
+        """Como match(), mas {posição do título: índice da pasta} (nomes podem se repetir)."""
+        scored = []
+        for pos, title in enumerate(titles):
+            title_norm = normalize(title)
+            if not title_norm:
+                continue
+            scored += [(ratio, pos, idx) for ratio, idx in self.pairs(title_norm)]
+
+        # Melhores pares primeiro; empate decide pela ordem da discografia
+        scored.sort(key=lambda s: (-s[0], s[1], s[2]))
+        result, used = {}, set()
+        for ratio, pos, idx in scored:
+            if pos in result or idx in used:
+                continue
+            result[pos] = idx
+            used.add(idx)
+        return result
@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize(text):
+    """Minúsculas, sem acentos e só letras/números separados por um espaço."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    return re.sub(r"[\W_]+", " ", text).strip()
+
+
+class ArtistIndex:
+    """
+    Busca de artistas local para o autocomplete da Home.
+    Índice invertido em SQLite (search_terms: uma linha por palavra do nome),
+    alimentado pelos artistas da biblioteca e pelos resultados já vistos do
+    Deezer. Cada palavra digitada é um prefixo, resolvido como uma faixa no
+    índice. O Deezer só é consultado quando o local não basta, e as respostas
+    remotas ficam num LRU limitado, com chave na consulta normalizada.
+    """
+    REMOTE_CACHE_SIZE = 512
+    REMOTE_TTL = 3600
+    # Sem artista novo na biblioteca, reconcilia no máximo a cada N segundos
+    LIBRARY_SYNC_INTERVAL = 60
+
+    def __init__(self, db, metadata_provider):
+        self.db = db
+        self.metadata = metadata_provider
+        self.lock = threading.Lock()
+        self.remote = OrderedDict()   # consulta normalizada -> (quando, resultados)
+        self._synced_at = 0
+        self._synced_count = None
+
+    def add(self, artists, in_library=False):
+        """Indexa artistas no formato da busca ({'id', 'name', 'fans', 'image'})."""
+        artists = [a for a in artists if a.get('id') and a.get('name')]
+        if not artists:
+            return
+        with self.db.transaction():
+            self.db.executemany(
+                """INSERT INTO search_artists (deezer_id, name, fans, image_url, in_library)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(deezer_id) DO UPDATE SET
+                       name = excluded.name,
+                       fans = CASE WHEN excluded.fans > 0 THEN excluded.fans ELSE search_artists.fans END,
+                       image_url = COALESCE(NULLIF(excluded.image_url, ''), search_artists.image_url),
+                       in_library = MAX(search_artists.in_library, excluded.in_library),
+                       updated_at = CURRENT_TIMESTAMP""",
+                [(str(a['id']), a['name'], a.get('fans') or 0, a.get('image') or '', int(in_library)) for a in artists]
+            )
+            self.db.executemany("DELETE FROM search_terms WHERE deezer_id=?", [(str(a['id']),) for a in artists])
+            self.db.executemany(
+                "INSERT OR IGNORE INTO search_terms (term, deezer_id) VALUES (?, ?)",
+                [(term, str(a['id'])) for a in artists for term in set(normalize(a['name']).split())]
+            )
+
+    def sync_library(self, force=False):
+        """Traz para o índice artistas novos/renomeados da biblioteca e desmarca os removidos."""
+        count = self.db.get_counter('artists')
+        now = time.monotonic()
+        if not force and count == self._synced_count and now - self._synced_at < self.LIBRARY_SYNC_INTERVAL:
+            return
+        self._synced_count, self._synced_at = count, now
+
+        rows = self.db.query('''SELECT a.deezer_id, a.name, a.image_url FROM artists a
+            LEFT JOIN search_artists s ON s.deezer_id = a.deezer_id
+            WHERE s.deezer_id IS NULL OR s.in_library = 0 OR s.name IS NOT a.name''')
+        self.add([{'id': r['deezer_id'], 'name': r['name'], 'image': r['image_url']} for r in rows], in_library=True)
+        self.db.execute('''UPDATE search_artists SET in_library = 0
+            WHERE in_library = 1 AND deezer_id NOT IN (SELECT deezer_id FROM artists)''')
+
+    def search(self, query, limit=5):
+        """Só local: todas as palavras da consulta precisam casar como prefixo de alguma palavra do nome."""
+        nq = normalize(query)
+        ids = None
+        for token in nq.split():
+            rows = self.db.query("SELECT DISTINCT deezer_id FROM search_terms WHERE term >= ? AND term < ?",
+                                 (token, token + '\uffff'))
+            found = {r['deezer_id'] for r in rows}
+            ids = found if ids is None else ids & found
+            if not ids:
+                return []
+        if not ids:
+            return []
+
+        ids = list(ids)
+        rows = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows += self.db.query(f"SELECT * FROM search_artists WHERE deezer_id IN ({marks})", chunk)
+
+        # Biblioteca primeiro, depois nome começando pela consulta, depois popularidade
+        rows.sort(key=lambda r: (-r['in_library'], not normalize(r['name']).startswith(nq), -r['fans'], r['name']))
+        return [{
+            'id': r['deezer_id'],
+            'name': r['name'],
+            'genre': "Na biblioteca" if r['in_library'] else f"{r['fans']} fãs",
+            'image': r['image_url'] or '',
+            'fans': r['fans'],
+        } for r in rows[:limit]]
+
+    def _remote(self, query):
+        nq = normalize(query)
+        with self.lock:
+            hit = self.remote.get(nq)
+            if hit and time.monotonic() - hit[0] < self.REMOTE_TTL:
+                self.remote.move_to_end(nq)
+                return hit[1]
+
+        results = self.metadata.find_potential_artists(query)
+        if results:
+            self.add(results)
+            with self.lock:
+                self.remote[nq] = (time.monotonic(), results)
+                self.remote.move_to_end(nq)
+                while len(self.remote) > self.REMOTE_CACHE_SIZE:
+                    self.remote.popitem(last=False)
+        return results
+
+    def lookup(self, query, limit=5):
+        """Local primeiro; completa com o Deezer só se faltarem resultados."""
+        self.sync_library()
+        local = self.search(query, limit)
+        # Basta se encheu a lista e algum nome começa pelo que foi digitado
+        nq = normalize(query)
+        if len(local) >= limit and any(normalize(a['name']).startswith(nq) for a in local):
+            return local
+
+        seen = {a['id'] for a in local}
+        remote = [a for a in self._remote(query) if a['id'] not in seen]
+        return (local + remote)[:limit]
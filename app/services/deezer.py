@@ -1,20 +1,21 @@
-import requests
+from .deezer_http import deezer_http
 
 class DeezerClient:
+    def __init__(self, transport=None):
+        self.http = transport or deezer_http
+
     def get_recommendations(self, artist_name):
         """Busca artistas similares usando a API pública do Deezer."""
         try:
 
-            search_url = f"https://api.deezer.com/search/artist?q={artist_name}&limit=1"
-            res = requests.get(search_url, timeout=10).json()
+            res = self.http.get_json("/search/artist", params={'q': artist_name, 'limit': 1})
             
             if not res.get('data'):
                 return []
             
             artist_id = res['data'][0]['id']
             
-            related_url = f"https://api.deezer.com/artist/{artist_id}/related&limit=12"
-            res_related = requests.get(related_url, timeout=10).json()
+            res_related = self.http.get_json(f"/artist/{artist_id}/related", params={'limit': 12})
             
             results = []
             for item in res_related.get('data', []):
@@ -1,18 +1,47 @@
-import requests
-import time
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from difflib import SequenceMatcher
 from .logger import sys_logger
+from .deezer_http import deezer_http, DeezerAPIError
+from .singleflight import SingleFlight
+from .filters import DEFAULT_FILTER
 
 class DeezerDataClient:
     BASE_URL = "https://api.deezer.com"
 
-    def _get(self, endpoint, params=None):
+    def __init__(self, transport=None, cache=None):
+        # Sessão, cota e retries compartilhados com todo o app (ver deezer_http)
+        self.http = transport or deezer_http
+        # Cache persistente opcional (MetadataCache) com TTL por tipo de endpoint
+        self.cache = cache
+        # Pedidos idênticos simultâneos (dashboard, sync, spider...) viram uma chamada só
+        self.inflight = SingleFlight()
+
+    def _get(self, endpoint, params=None, strict=False):
+        """
+        strict=True propaga DeezerAPIError (discografia/faixas: dado parcial é pior que nenhum).
+        Nas buscas simples a falha já foi logada pelo transporte e vira {}.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(endpoint, params)
+            if cached is not None:
+                return cached
+
+        def fetch():
+            data = self.http.get_json(endpoint, params=params)
+            # Erros do Deezer (ex.: artista inexistente) não vão para o cache
+            if self.cache is not None and isinstance(data, dict) and 'error' not in data:
+                self.cache.put(endpoint, params, data)
+            return data
+
+        key = (endpoint, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
         try:
-            res = requests.get(f"{self.BASE_URL}{endpoint}", params=params, timeout=15)
-            time.sleep(0.2)
-            return res.json()
-        except: return {}
+            return self.inflight.do(key, fetch)
+        except DeezerAPIError:
+            if strict: raise
+            return {}
 
     def get_artist_by_id(self, artist_id):
         data = self._get(f"/artist/{artist_id}")
@@ -21,12 +50,14 @@ class DeezerDataClient:
                 'id': str(data['id']),
                 'name': data['name'],
                 'genre': 'Music',
-                'image': data.get('picture_xl', data.get('picture_medium', ''))
+                'image': data.get('picture_xl', data.get('picture_medium', '')),
+                'fans': data.get('nb_fan', 0) or 0,
+                'albums': data.get('nb_album', 0) or 0
             }
         return None
 
-    def search_artist(self, name):
-        data = self._get("/search/artist", params={'q': name, 'limit': 1})
+    def search_artist(self, name, strict=False):
+        data = self._get("/search/artist", params={'q': name, 'limit': 1}, strict=strict)
         if data.get('data'):
             item = data['data'][0]
             return {
@@ -56,6 +87,16 @@ class DeezerDataClient:
             })
         return results
 
+    def get_related_by_id(self, artist_id, limit=25):
+        """Relacionados direto pelo ID (sem busca por nome), com nº de fãs. Propaga DeezerAPIError."""
+        data = self._get(f"/artist/{artist_id}/related", params={'limit': limit}, strict=True)
+        return [{
+            'id': str(item['id']),
+            'name': item['name'],
+            'fans': item.get('nb_fan', 0) or 0,
+            'image': item.get('picture_xl', item.get('picture_medium', ''))
+        } for item in data.get('data', [])]
+
     def find_potential_artists(self, name):
         """Busca simples por nome (usado na Home)"""
         data = self._get("/search/artist", params={'q': name, 'limit': 5})
@@ -65,60 +106,159 @@ class DeezerDataClient:
                 'id': str(item['id']),
                 'name': item['name'],
                 'genre': f"{item.get('nb_fan', 0)} fãs",
-                'image': item.get('picture_medium', '')
+                'image': item.get('picture_medium', ''),
+                'fans': item.get('nb_fan', 0) or 0
             })
         return results
 
-    def get_discography(self, artist_id, target_artist_id=None, blacklist=None):
+    # Chamadas simultâneas por operação (a cota global continua no deezer_http)
+    FETCH_CONCURRENCY = 6
+    PAGE_SIZE = 100
+
+    def _parallel(self, fn, items):
+        """Aplica fn em paralelo (concorrência limitada) e devolve os resultados na mesma ordem."""
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(i) for i in items]
+        with ThreadPoolExecutor(max_workers=min(self.FETCH_CONCURRENCY, len(items)), thread_name_prefix="deezer") as ex:
+            return list(ex.map(fn, items))
+
+    def _discography_pages(self, artist_id, prefetch=None):
+        """
+        Páginas cruas da discografia, em ordem, uma por vez.
+        Com o 'total' da primeira página, mantém até `prefetch` (padrão
+        FETCH_CONCURRENCY) páginas em voo: rápido sem acumular a discografia inteira.
+        """
+        prefetch = prefetch or self.FETCH_CONCURRENCY
+        fetch = lambda idx: self._get(f"/artist/{artist_id}/albums?limit={self.PAGE_SIZE}&index={idx}", strict=True)
+
+        first = self._get(f"/artist/{artist_id}/albums?limit={self.PAGE_SIZE}", strict=True)
+        first_items = first.get('data', [])
+        yield first_items
+        total = first.get('total')
+
+        if isinstance(total, int) and total > len(first_items):
+            indexes = iter(range(len(first_items), total, self.PAGE_SIZE))
+            ex = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="deezer")
+            window = deque(ex.submit(fetch, idx) for idx in islice(indexes, prefetch))
+            try:
+                while window:
+                    page = window.popleft().result()
+                    nxt = next(indexes, None)
+                    if nxt is not None:
+                        window.append(ex.submit(fetch, nxt))
+                    yield page.get('data', [])
+            finally:
+                # Consumidor parou no meio (ou erro): não deixa páginas órfãs baixando
+                for f in window: f.cancel()
+                ex.shutdown(wait=False)
+        else:
+            next_url = first.get('next')
+            while next_url:
+                data = self._get(next_url.replace(self.BASE_URL, ""), strict=True)
+                yield data.get('data', [])
+                next_url = data.get('next')
+
+    def _filter_discography_page(self, items, target_norm, album_filter, seen=None, rejected=None):
+        """
+        Álbuns da página que passam no filtro e são do artista. Em `seen` entram
+        só os avaliados até o fim (aceitos, barrados pelo filtro, de outro
+        artista); os que ficaram sem detalhes por falha do Deezer são tentados de novo.
+        Os barrados pelo filtro também vão para `rejected` ({id: motivo}).
+        """
+        seen = set() if seen is None else seen
+        candidates = []
+        for item in items:
+            reason = album_filter.reason(item['title'], item.get('record_type', 'album'), item.get('nb_tracks', 0))
+            if reason:
+                sys_logger.log("FILTER", f"🚫 Ignorado ({reason}): {item['title']}")
+                seen.add(str(item['id']))
+                if rejected is not None:
+                    rejected[str(item['id'])] = reason
+                continue
+            candidates.append(item)
+
+        # A listagem do artista nem sempre traz o artista do álbum: resolve os detalhes em paralelo
+        missing = [item['id'] for item in candidates if not (item.get('artist') or {}).get('name')]
+        details = dict(zip(missing, self._parallel(lambda aid: self._get(f"/album/{aid}"), missing)))
+
         albums = []
-        next_url = f"/artist/{artist_id}/albums?limit=100"
-        target_norm = target_artist_id.lower().strip() if target_artist_id else ""
-        
-        if not blacklist: blacklist = []
-        blacklist = [b.lower().strip() for b in blacklist if b.strip()]
+        for item in candidates:
+            try:
+                album_artist = item.get('artist', {}).get('name', '').lower().strip()
+                if not album_artist:
+                    det = details.get(item['id']) or {}
+                    album_artist = det.get('artist', {}).get('name', '').lower().strip()
+                if not album_artist: continue   # detalhes falharam: não conta como visto
 
-        while next_url:
-            endpoint = next_url.replace(self.BASE_URL, "")
-            data = self._get(endpoint)
-            
-            for item in data.get('data', []):
-                title = item['title']
-                title_lower = title.lower()
-
-                blocked_word = next((bad for bad in blacklist if bad in title_lower), None)
-                if blocked_word:
-                    sys_logger.log("FILTER", f"🚫 Ignorado (Filtro '{blocked_word}'): {title}")
-                    continue
-
-                rec_type = item.get('record_type', 'album').lower()
-                if rec_type == 'compile':
-                    sys_logger.log("FILTER", f"🚫 Ignorado (Coletânea): {title}")
-                    continue
-
-                try:
-                    album_artist = item.get('artist', {}).get('name', '').lower().strip()
-                    if not album_artist:
-                        det = self._get(f"/album/{item['id']}")
-                        album_artist = det.get('artist', {}).get('name', '').lower().strip()
-                    
-                    if not album_artist.startswith(target_norm): continue
-                    if "various" in album_artist or "vários" in album_artist: continue
-                except: continue
-
-                albums.append({
-                    'deezer_id': str(item['id']),
-                    'title': title,
-                    'year': item.get('release_date', '0000')[:4],
-                    'track_count': item.get('nb_tracks', 0),
-                    'type': rec_type,
-                    'cover': item.get('cover_xl', item.get('cover_medium', ''))
-                })
-            
-            next_url = data.get('next')
+                seen.add(str(item['id']))
+                if not album_artist.startswith(target_norm): continue
+                if "various" in album_artist or "vários" in album_artist: continue
+            except: continue
+
+            albums.append({
+                'deezer_id': str(item['id']),
+                'title': item['title'],
+                'year': item.get('release_date', '0000')[:4],
+                'track_count': item.get('nb_tracks', 0),
+                'type': item.get('record_type', 'album').lower(),
+                'cover': item.get('cover_xl', item.get('cover_medium', ''))
+            })
         return albums
 
+    def iter_discography(self, artist_id, target_artist_id=None, album_filter=None, seen=None, rejected=None, recheck=None):
+        """
+        Versão em streaming de get_discography: gera uma lista de álbuns já
+        filtrados por página, assim que cada página chega. `album_filter`
+        (AlbumFilter, normalmente db.settings.album_filter) aplica palavras
+        ignoradas, tipo e limite de faixas; sem ele só coletâneas saem.
+
+        `seen` (set de IDs de álbuns já avaliados deste artista) liga o modo
+        incremental: IDs vistos são pulados antes de qualquer filtro ou
+        consulta extra, os novos que terminaram de ser avaliados são
+        acrescentados ao set, e — se o set não começou vazio — a paginação
+        para na primeira página sem nada novo (o Deezer lista a discografia do
+        mais recente para o mais antigo). Os barrados pelo filtro vão também
+        para `rejected` ({id: motivo}). `recheck` (IDs barrados por um filtro
+        que já mudou, fora de `seen`) mantém a paginação andando até todos
+        reaparecerem; os encontrados saem do set.
+        """
+        target_norm = target_artist_id.lower().strip() if target_artist_id else ""
+        album_filter = album_filter or DEFAULT_FILTER
+
+        incremental = bool(seen)
+        for items in self._discography_pages(artist_id, prefetch=1 if incremental else None):
+            if seen is not None:
+                fresh = [item for item in items if str(item['id']) not in seen]
+                if recheck:
+                    recheck.difference_update(str(item['id']) for item in fresh)
+                if incremental and items and not fresh and not recheck:
+                    break
+                items = fresh
+            albums = self._filter_discography_page(items, target_norm, album_filter, seen, rejected)
+            if albums:
+                yield albums
+
+    def get_discography(self, artist_id, target_artist_id=None, album_filter=None):
+        return [alb for page in self.iter_discography(artist_id, target_artist_id, album_filter) for alb in page]
+
+    def get_albums_tracks(self, album_ids, fallback_artist=""):
+        """
+        Tracklists de vários álbuns em paralelo: {album_id: faixas}.
+        Álbuns cuja tracklist falhou ficam de fora (o erro já foi logado).
+        """
+        def fetch(aid):
+            try:
+                return self.get_album_tracks(aid, fallback_artist=fallback_artist)
+            except DeezerAPIError:
+                return None
+
+        album_ids = [str(a) for a in album_ids]
+        results = self._parallel(fetch, album_ids)
+        return {aid: tracks for aid, tracks in zip(album_ids, results) if tracks is not None}
+
     def get_album_tracks(self, album_id, fallback_artist=""):
-        data = self._get(f"/album/{album_id}/tracks?limit=500")
+        data = self._get(f"/album/{album_id}/tracks?limit=500", strict=True)
         tracks = []
         main_artist = fallback_artist
         
@@ -140,7 +280,8 @@ class DeezerDataClient:
                 'artist': final_artist_tag,
                 'album_artist': final_artist_tag,
                 'track_num': item.get('track_position', 0) or item.get('track_index', 0),
-                'duration': item.get('duration', 0)
+                'duration': item.get('duration', 0),
+                'isrc': item.get('isrc')
             })
             
         return tracks
\ No newline at end of file
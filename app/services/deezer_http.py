@@ -0,0 +1,115 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .logger import sys_logger
+
+
+class DeezerAPIError(Exception):
+    """A API não respondeu de forma utilizável mesmo depois das novas tentativas."""
+
+
+class TokenBucket:
+    """Limitador thread-safe: no máximo `capacity` chamadas em rajada, repondo `rate` por segundo."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # Reserva a ficha já (saldo pode ficar negativo) e dorme fora do lock
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def drain(self):
+        """Zera o saldo (ex.: a API avisou que a cota estourou)."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0)
+
+
+class DeezerTransport:
+    """
+    Camada HTTP única para a API pública do Deezer: sessão keep-alive com pool
+    de conexões, cota global (50 req / 5 s, publicada pelo Deezer) compartilhada
+    por todas as threads e novas tentativas com backoff + jitter para cota
+    excedida, 5xx e falhas de rede.
+    """
+    BASE_URL = "https://api.deezer.com"
+    QUOTA_ERROR_CODE = 4
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, rate=9.0, burst=45, max_retries=5, timeout=15):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt):
+        return min(30.0, 2 ** attempt) + random.uniform(0, 1)
+
+    def get_json(self, endpoint, params=None):
+        """
+        GET em `endpoint` (caminho relativo ou URL completa) e retorna o JSON.
+        Erros "de negócio" do Deezer (ex.: artista inexistente) voltam como dict;
+        cota/5xx/rede são repetidos e, se persistirem, levantam DeezerAPIError.
+        """
+        url = endpoint if endpoint.startswith("http") else f"{self.BASE_URL}{endpoint}"
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self._backoff(attempt - 1))
+
+            self.bucket.acquire()
+            try:
+                res = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                last_error = f"rede: {e}"
+                continue
+
+            if res.status_code in self.RETRY_STATUS:
+                last_error = f"HTTP {res.status_code}"
+                if res.status_code == 429:
+                    self.bucket.drain()
+                continue
+
+            try:
+                data = res.json()
+            except ValueError:
+                last_error = f"resposta inválida (HTTP {res.status_code})"
+                if res.status_code >= 400:
+                    break
+                continue
+
+            error = data.get("error") if isinstance(data, dict) else None
+            if isinstance(error, dict) and error.get("code") == self.QUOTA_ERROR_CODE:
+                last_error = "cota excedida"
+                self.bucket.drain()
+                continue
+
+            return data
+
+        sys_logger.log("ERROR", f"Deezer API falhou ({last_error}): {url}")
+        raise DeezerAPIError(f"{last_error}: {url}")
+
+
+deezer_http = DeezerTransport()
@@ -1,5 +1,6 @@
 import os
 import time
+import threading
 import requests
 import traceback
 import re
@@ -10,6 +11,7 @@ from deemix import generateDownloadObject
 from deemix.downloader import Downloader as DeemixDownloader
 
 from .logger import sys_logger
+from .singleflight import SingleFlight
 
 # --- PATCHES DE CORREÇÃO PARA A BIBLIOTECA DEEMIX ---
 def apply_patches():
@@ -64,28 +66,100 @@ def apply_patches():
         sys_logger.log("SYSTEM", f"🩹 Patches aplicados: {', '.join(applied)}")
 
 
+class TrackListener:
+    """
+    Listener do deemix: guarda os caminhos finais e os erros reportados
+    nos eventos 'updateQueue' e sinaliza o fim em 'finishDownload'.
+    """
+    def __init__(self):
+        self.paths = []
+        self.errors = []
+        self.events = 0
+        self.done = threading.Event()
+        # Modo álbum: ID da faixa em andamento (setado por AlbumAwareDownloader)
+        self.current_id = None
+        self.paths_by_track = {}
+        self.errors_by_track = {}
+
+    def send(self, key, value=None):
+        self.events += 1
+        if key == "updateQueue" and isinstance(value, dict):
+            if (value.get("downloaded") or value.get("alreadyDownloaded")) and value.get("downloadPath"):
+                path = str(value["downloadPath"])
+                self.paths.append(path)
+                if self.current_id:
+                    self.paths_by_track.setdefault(self.current_id, []).append(path)
+            if value.get("failed"):
+                error = str(value.get("error") or value.get("errid") or "erro desconhecido")
+                self.errors.append(error)
+                failed_id = (value.get("data") or {}).get("id") or self.current_id
+                if failed_id:
+                    self.errors_by_track[str(failed_id)] = error
+        elif key == "finishDownload":
+            self.done.set()
+
+    def sendError(self, e, v=None):
+        self.errors.append(str(e))
+
+
+class AlbumAwareDownloader(DeemixDownloader):
+    """Informa ao listener qual faixa do álbum está sendo baixada (queueConcurrency=1)."""
+    def downloadWrapper(self, extraData, *args, **kwargs):
+        track_api = extraData.get("trackAPI") or {}
+        track_id = track_api.get("id") or track_api.get("SNG_ID")
+        if self.listener is not None:
+            self.listener.current_id = str(track_id) if track_id else None
+        return super().downloadWrapper(extraData, *args, **kwargs)
+
+
 class Downloader:
+    # Só atua se o deemix rodar o download de forma assíncrona (start() normalmente bloqueia)
+    DOWNLOAD_TIMEOUT = 45
+
     def __init__(self, db):
         self.db = db
-        self.dz = Deezer()
-        self.logged_in = False
+        # Uma sessão Deezer (e login) por thread: vários workers baixam em paralelo
+        # e o objeto Deezer/requests.Session não é seguro para uso concorrente.
+        self._local = threading.local()
+        self._login_lock = threading.Lock()
+        # Trocar o ARL nos Ajustes invalida os logins de todas as threads
+        self._arl_generation = 0
+        db.settings.subscribe(self._on_arl_changed, keys=["deezer_arl"])
+        # Dict de settings do deemix montado uma vez; refeito só quando a qualidade muda
+        db.settings.register("deemix_settings", ["download_quality"], self._deemix_settings)
+        self._image_flight = SingleFlight()
         
         # Aplica os curativos ao iniciar
         apply_patches()
 
+    def _on_arl_changed(self, key, value):
+        self._arl_generation += 1
+
+    @property
+    def dz(self):
+        dz = getattr(self._local, 'dz', None)
+        if dz is None or self._local.generation != self._arl_generation:
+            dz = self._local.dz = Deezer()
+            self._local.generation = self._arl_generation
+            self._local.logged_in = False
+        return dz
+
     def sanitize(self, name):
         if not name: return "Unknown"
         return "".join([c for c in name if c.isalpha() or c.isdigit() or c in " .-_()"]).strip()
 
     def _login(self):
         try:
-            if self.logged_in: return True
-            arl = self.db.get_setting("deezer_arl")
+            dz = self.dz
+            if self._local.logged_in: return True
+            arl = self.db.settings.get("deezer_arl")
             if not arl:
                 sys_logger.log("DL", "⚠️ ARL ausente. Configure em Ajustes.")
                 return False
-            self.dz.login_via_arl(arl)
-            self.logged_in = True
+            # Serializa os logins para não disparar vários ao mesmo tempo na Deezer
+            with self._login_lock:
+                dz.login_via_arl(arl)
+            self._local.logged_in = True
             return True
         except Exception as e:
             sys_logger.log("ERROR", f"Login Deezer falhou: {e}")
@@ -97,18 +171,29 @@ class Downloader:
             safe_name = self.sanitize(artist_name)
             save_path = f"/config/artist_images/{safe_name}.jpg"
             if os.path.exists(save_path): return True
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            res = requests.get(url, stream=True, timeout=15)
-            if res.status_code == 200:
-                with open(save_path, "wb") as f:
-                    for chunk in res.iter_content(1024):
-                        f.write(chunk)
-                return True
-            return False
+            # Vários pedidos da mesma imagem ao mesmo tempo: um download, uma escrita
+            return self._image_flight.do(save_path, lambda: self._fetch_image(url, save_path))
         except Exception as e:
             sys_logger.log("ERROR", f"Erro img {artist_name}: {e}")
             return False
 
+    def _fetch_image(self, url, save_path):
+        if os.path.exists(save_path): return True
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        res = requests.get(url, stream=True, timeout=15)
+        if res.status_code != 200:
+            return False
+        # Grava num temporário e troca de uma vez: quem lê nunca vê imagem pela metade
+        tmp_path = f"{save_path}.{threading.get_ident()}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in res.iter_content(1024):
+                    f.write(chunk)
+            os.replace(tmp_path, save_path)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+        return True
+
     def split_main_and_features(self, artist_str: str) -> Tuple[str, List[str]]:
         if not artist_str: return ("Unknown", [])
         s = artist_str.strip()
@@ -173,14 +258,161 @@ class Downloader:
         except: return False
 
     def _list_audio_files(self, folder: str) -> List[str]:
-        if not os.path.exists(folder): return []
-        return [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith((".mp3", ".flac", ".m4a"))]
+        # Pasta temporária em /downloads (fora do índice de /music): uma listagem, sem exists antes
+        try:
+            with os.scandir(folder) as it:
+                return [e.path for e in it if e.name.lower().endswith((".mp3", ".flac", ".m4a")) and e.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def _deemix_settings(self, settings_service):
+        qual_setting = settings_service.get("download_quality")
+
+        # --- CONFIGURAÇÃO BLINDADA ---
+        return {
+            "downloadLocation": "",
+            "tracknameTemplate": "%tracknumber% - %title%",
+            "albumTracknameTemplate": "%tracknumber% - %title%",
+            "playlistTracknameTemplate": "%position% - %artist% - %title%",
+            "createPlaylistFolder": True,
+            "playlistNameTemplate": "%playlist%",
+            "createArtistFolder": False,
+            "createAlbumFolder": False,
+            "albumNameTemplate": "%artist% - %album%",
+            "createCDFolder": True,
+            "createStructurePlaylist": False,
+            "createSingleFolder": True,
+            "padTracks": True,
+            "padSingleDigit": True,
+            "paddingSize": "0",
+            "illegalCharacterReplacer": "_",
+            "queueConcurrency": 1,
+            "maxBitrate": int(qual_setting),
+            "feelingLucky": False,
+            "fallbackBitrate": True,
+            "fallbackSearch": False,
+            "fallbackISRC": False,
+            "logErrors": True,
+            "logSearched": True,
+            "overwriteFile": "n",
+            "createM3U8File": False,
+            "playlistFilenameTemplate": "playlist",
+            "syncedLyrics": True,
+            "embeddedArtworkSize": 800,
+            "embeddedArtworkPNG": False,
+            "localArtworkSize": 1200,
+            "localArtworkFormat": "jpg",
+            "saveArtwork": True,
+            "coverImageTemplate": "cover",
+            "saveArtworkArtist": False,
+            "jpegImageQuality": 100,
+            "dateFormat": "Y-M-D",
+            "albumVariousArtists": True,
+            "removeAlbumVersion": False,
+            "removeDuplicateArtists": True,
+
+            "featuredToTitle": "2",
+            "titleCasing": "nothing",
+            "artistCasing": "nothing",
+            "multiArtistSeparator": " & ",
+
+            # CHAVE OBRIGATÓRIA (Evita KeyError)
+            "executeCommand": "",
+
+            "tags": {
+                "title": True, "artist": True, "album": True, "cover": True,
+                "trackNumber": True, "trackTotal": False, "discNumber": True, "discTotal": True,
+                "albumArtist": True, "genre": True, "year": True, "date": True,
+                "explicit": False,
+                # ISRC e SOURCEID (ID do Deezer): o TrackLinker liga as faixas aos arquivos por eles
+                "isrc": True, "source": True,
+
+                # DESATIVADOS (Evita crashes com dados faltantes)
+                "length": False,
+                "barcode": False,
+                "bpm": False,
+
+                "replayGain": False, "label": True, "lyrics": False, "syncedLyrics": False,
+                "copyright": False, "composer": False, "involvedPeople": False,
+                "rating": False, "savePlaylistAsCompilation": False, "useNullSeparator": False,
+                "saveID3v1": True, "multiArtistSeparator": " & ", "singleAlbumArtist": True,
+                "coverDescriptionUTF8": False, "artists": False
+            }
+        }
+
+    def _build_settings(self, target_folder):
+        settings = dict(self.db.settings.computed("deemix_settings"))
+        settings["downloadLocation"] = target_folder
+        return settings
 
-    def _newest_file(self, folder: str) -> Optional[str]:
-        files = self._list_audio_files(folder)
-        if not files: return None
-        files.sort(key=lambda p: os.path.getmtime(p), reverse=True)
-        return files[0]
+    def _retag(self, files, track_meta):
+        """Main artist em ARTIST/ALBUMARTIST e convidados no título (feat.)."""
+        raw_artist = (track_meta.get("artist") or "").strip()
+        main_artist, feats = self.split_main_and_features(raw_artist)
+        album_artist = (track_meta.get("album_artist") or main_artist).strip()
+        new_title = self.apply_feat_to_title(track_meta.get("title"), feats)
+
+        # Retagging final para garantir limpeza
+        for fp in files:
+            self._tag_file(fp, main_artist=main_artist, album_artist=album_artist, new_title=new_title)
+
+    def _run_deemix(self, url, settings, listener, downloader_cls=None):
+        download_obj = generateDownloadObject(self.dz, url, settings["maxBitrate"])
+        dmx = (downloader_cls or DeemixDownloader)(self.dz, download_obj, settings, listener)
+        dmx.start()
+        if not (listener.done.is_set() or listener.paths or listener.errors):
+            listener.done.wait(self.DOWNLOAD_TIMEOUT)
+
+    def download_album(self, album_id, tracks_meta, target_folder):
+        """
+        Baixa o álbum inteiro com um único objeto do deemix (metadados e capa
+        resolvidos uma vez) e reaplica a tag de main artist/feat em cada faixa.
+        Retorna ({deezer_id: [arquivos]}, {deezer_id: erro}); faixas fora dos
+        dois dicts não foram identificadas e devem cair no modo por faixa.
+        """
+        try:
+            if not self._login(): return {}, {}
+            settings = self._build_settings(target_folder)
+
+            listener = TrackListener()
+            self._run_deemix(f"https://www.deezer.com/album/{album_id}", settings, listener,
+                             downloader_cls=AlbumAwareDownloader)
+
+            by_id = {str(t.get("deezer_id")): t for t in tracks_meta if t.get("deezer_id")}
+            files = {}
+            for tid, paths in listener.paths_by_track.items():
+                if tid in by_id:
+                    files[tid] = [fp for fp in paths if os.path.exists(fp)]
+
+            # Sem ID no evento (versão do deemix sem trackAPI): casa pelo número no nome do arquivo
+            assigned = {fp for paths in files.values() for fp in paths}
+            by_number = {}
+            for t in tracks_meta:
+                by_number.setdefault(t.get("track_num"), []).append(str(t.get("deezer_id")))
+            for fp in listener.paths:
+                if fp in assigned or not os.path.exists(fp): continue
+                m = re.match(r"^(\d+)\s*-", os.path.basename(fp))
+                ids = by_number.get(int(m.group(1))) if m else None
+                if ids and len(ids) == 1 and ids[0] in by_id and ids[0] not in files:
+                    files[ids[0]] = [fp]
+                    assigned.add(fp)
+                else:
+                    # Faixa que não está na fila (bônus filtrado etc.): não deixa lixo no temp
+                    try: os.remove(fp)
+                    except OSError: pass
+
+            files = {tid: paths for tid, paths in files.items() if paths}
+            for tid, paths in files.items():
+                self._retag(paths, by_id[tid])
+
+            errors = {tid: err for tid, err in listener.errors_by_track.items() if tid in by_id and tid not in files}
+            if errors:
+                sys_logger.log("DL", f"⚠️ Deemix (álbum {album_id}): {len(errors)} faixa(s) com erro")
+            return files, errors
+
+        except Exception as e:
+            sys_logger.log("ERROR", f"Erro Deemix (álbum): {e}")
+            return {}, {}
 
     def download_track(self, track_meta, target_folder):
         try:
@@ -188,117 +420,27 @@ class Downloader:
             tid = track_meta.get("deezer_id")
             if not tid: return []
 
-            # Prepara pastas e nomes
-            raw_artist = (track_meta.get("artist") or "").strip()
-            main_artist, feats = self.split_main_and_features(raw_artist)
-            album_artist = (track_meta.get("album_artist") or main_artist).strip()
-            new_title = self.apply_feat_to_title(track_meta.get("title"), feats)
-            
-            qual_setting = self.db.get_setting("download_quality") or "3"
-            
-            # --- CONFIGURAÇÃO BLINDADA ---
-            settings = {
-                "downloadLocation": target_folder,
-                "tracknameTemplate": "%tracknumber% - %title%",
-                "albumTracknameTemplate": "%tracknumber% - %title%",
-                "playlistTracknameTemplate": "%position% - %artist% - %title%",
-                "createPlaylistFolder": True,
-                "playlistNameTemplate": "%playlist%",
-                "createArtistFolder": False,
-                "createAlbumFolder": False,
-                "albumNameTemplate": "%artist% - %album%",
-                "createCDFolder": True,
-                "createStructurePlaylist": False,
-                "createSingleFolder": True,
-                "padTracks": True,
-                "padSingleDigit": True,
-                "paddingSize": "0",
-                "illegalCharacterReplacer": "_",
-                "queueConcurrency": 1,
-                "maxBitrate": int(qual_setting),
-                "feelingLucky": False,
-                "fallbackBitrate": True,
-                "fallbackSearch": False,
-                "fallbackISRC": False,
-                "logErrors": True,
-                "logSearched": True,
-                "overwriteFile": "n",
-                "createM3U8File": False,
-                "playlistFilenameTemplate": "playlist",
-                "syncedLyrics": True,
-                "embeddedArtworkSize": 800,
-                "embeddedArtworkPNG": False,
-                "localArtworkSize": 1200,
-                "localArtworkFormat": "jpg",
-                "saveArtwork": True,
-                "coverImageTemplate": "cover",
-                "saveArtworkArtist": False,
-                "jpegImageQuality": 100,
-                "dateFormat": "Y-M-D",
-                "albumVariousArtists": True,
-                "removeAlbumVersion": False,
-                "removeDuplicateArtists": True,
-                
-                "featuredToTitle": "2",
-                "titleCasing": "nothing",
-                "artistCasing": "nothing",
-                "multiArtistSeparator": " & ",
-                
-                # CHAVE OBRIGATÓRIA (Evita KeyError)
-                "executeCommand": "",
-                
-                "tags": {
-                    "title": True, "artist": True, "album": True, "cover": True,
-                    "trackNumber": True, "trackTotal": False, "discNumber": True, "discTotal": True,
-                    "albumArtist": True, "genre": True, "year": True, "date": True,
-                    "explicit": False,
-                    
-                    # DESATIVADOS (Evita crashes com dados faltantes)
-                    "isrc": False,
-                    "length": False,
-                    "barcode": False,
-                    "bpm": False,
-                    
-                    "replayGain": False, "label": True, "lyrics": False, "syncedLyrics": False,
-                    "copyright": False, "composer": False, "involvedPeople": False, "source": False,
-                    "rating": False, "savePlaylistAsCompilation": False, "useNullSeparator": False,
-                    "saveID3v1": True, "multiArtistSeparator": " & ", "singleAlbumArtist": True,
-                    "coverDescriptionUTF8": False, "artists": False
-                }
-            }
+            settings = self._build_settings(target_folder)
 
             before = set(self._list_audio_files(target_folder))
 
-            url = f"https://www.deezer.com/track/{tid}"
-            download_obj = generateDownloadObject(self.dz, url, settings["maxBitrate"])
-            
-            class Listener:
-                def send(self, k, v=None): pass
-                def sendError(self, e, v=None): pass
-
-            dmx = DeemixDownloader(self.dz, download_obj, settings, Listener())
-            dmx.start()
-
-            # Aguarda e verifica o arquivo
-            new_files = []
-            for _ in range(45):
-                time.sleep(1)
-                now = set(self._list_audio_files(target_folder))
-                diff = list(now - before)
-                if diff:
-                    new_files = diff
-                    break
-            
-            # Fallback
-            if not new_files:
-                nf = self._newest_file(target_folder)
-                if nf: new_files = [nf]
+            # O deemix avisa pelo listener o caminho exato de cada arquivo finalizado
+            # (ou o erro): nada de polling na pasta nem "arquivo mais novo".
+            listener = TrackListener()
+            self._run_deemix(f"https://www.deezer.com/track/{tid}", settings, listener)
+
+            new_files = [fp for fp in listener.paths if os.path.exists(fp)]
+
+            if listener.errors:
+                sys_logger.log("DL", f"⚠️ Deemix ({tid}): {'; '.join(listener.errors)}")
+
+            # Versões do deemix sem eventos de progresso: compara a pasta uma única vez
+            if not new_files and not listener.events:
+                new_files = sorted(set(self._list_audio_files(target_folder)) - before)
 
             if not new_files: return []
 
-            # Retagging final para garantir limpeza
-            for fp in new_files:
-                self._tag_file(fp, main_artist=main_artist, album_artist=album_artist, new_title=new_title)
+            self._retag(new_files, track_meta)
 
             return new_files
 
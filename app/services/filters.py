@@ -0,0 +1,47 @@
+import re
+
+
+class AlbumFilter:
+    """
+    Regras de exclusão de álbuns (palavras ignoradas, tipo, limite de faixas)
+    compiladas uma vez: todas as palavras viram uma única regex, em vez de um
+    `any(b in title)` por álbum. Uma instância por configuração é compartilhada
+    por discografia, sync, spider, scheduler e limpeza da fila (ver
+    SettingsService.album_filter).
+    """
+    EXCLUDED_TYPES = frozenset({'compile'})
+
+    def __init__(self, keywords=(), max_tracks=None):
+        # Mais longas primeiro: o motivo logado é a palavra mais específica
+        self.keywords = tuple(sorted({k.strip().lower() for k in keywords if k and k.strip()}, key=lambda k: (-len(k), k)))
+        self.max_tracks = max_tracks
+        self._pattern = re.compile("|".join(map(re.escape, self.keywords))) if self.keywords else None
+
+    def blocked_keyword(self, title):
+        if self._pattern is None:
+            return None
+        m = self._pattern.search((title or "").lower())
+        return m.group(0) if m else None
+
+    def reason(self, title, record_type=None, track_count=None):
+        """Motivo da exclusão ou None se o álbum passa em todas as regras."""
+        keyword = self.blocked_keyword(title)
+        if keyword:
+            return f"Filtro '{keyword}'"
+        if (record_type or '').lower() in self.EXCLUDED_TYPES:
+            return "Coletânea"
+        if self.max_tracks is not None and (track_count or 0) > self.max_tracks:
+            return f"{track_count} faixas"
+        return None
+
+    def accepts(self, album):
+        """Álbum no formato do app ({'title', 'type', 'track_count'})."""
+        return self.reason(album.get('title'), album.get('type'), album.get('track_count')) is None
+
+    def rejects_sql(self, title, record_type, track_count):
+        """Versão para create_function do SQLite (1/0)."""
+        return 0 if self.reason(title, record_type, track_count) is None else 1
+
+
+# Sem configuração: só o tipo (coletâneas) é filtrado
+DEFAULT_FILTER = AlbumFilter()
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from .logger import sys_logger
+
+MUSIC_LIB_DIR = "/music"
+
+
+class LibraryIndex:
+    """
+    Índice persistente de /music em library_dirs: uma linha por pasta de
+    artista ("Artista") e de álbum ("Artista/Álbum"), com inode, mtime,
+    tamanho e quantidade de arquivos de áudio, formatos e imagem do artista.
+    A revarredura é incremental: uma pasta só é relistada (os.scandir) quando
+    o mtime ou o inode dela mudou; nas demais, valem os dados já gravados.
+    Scheduler, importação, scan e /artist_image consultam o índice em vez do disco.
+
+    O mtime de uma pasta muda quando entradas são criadas, apagadas ou
+    renomeadas nela, não quando um arquivo existente é reescrito: o tamanho
+    de um álbum pode ficar defasado até a pasta mudar (ou um refresh full).
+    """
+    AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.wav')
+    IMAGE_NAMES = ('folder.jpg', 'cover.jpg', 'artist.jpg', 'fanart.jpg')
+    # Sem quem avise das mudanças, o índice é revarrido se estiver mais velho que isso
+    MAX_AGE = 900
+
+    def __init__(self, db, root=MUSIC_LIB_DIR):
+        self.db = db
+        self.root = root
+        self.lock = threading.Lock()
+        # monotonic() conta de um ponto arbitrário (boot): None = nunca varrido
+        self.refreshed_at = None
+        # True enquanto o LibraryWatcher (inotify) mantém o índice atualizado
+        self.watched = False
+
+    # --- VARREDURA ---
+
+    def _list_dir(self, rel, st):
+        """Lista uma pasta: (linha para library_dirs, nomes das subpastas)."""
+        size = tracks = 0
+        formats, images, subdirs = set(), set(), []
+        with os.scandir(os.path.join(self.root, rel)) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                    continue
+                name = entry.name.lower()
+                if name.endswith(self.AUDIO_EXTENSIONS):
+                    tracks += 1
+                    size += entry.stat().st_size
+                    formats.add(name.rsplit('.', 1)[1])
+                elif name in self.IMAGE_NAMES:
+                    images.add(name)
+
+        image = next((img for img in self.IMAGE_NAMES if img in images), None)
+        parent, _, name = rel.rpartition('/')
+        row = (rel, parent, name, st.st_ino, st.st_mtime, size, tracks, ",".join(sorted(formats)) or None, image)
+        return row, subdirs
+
+    def _walk(self, rel, st, known, children, rows, seen, force):
+        """Indexa uma pasta de artista (e os álbuns dela), relistando só o que mudou."""
+        seen.add(rel)
+        is_album = '/' in rel
+        if force is not True and force != rel and known.get(rel) == (st.st_mtime, st.st_ino):
+            if is_album:
+                return
+            # Mesmo mtime: o conjunto de subpastas é o mesmo que já está no índice
+            subdirs = children.get(rel, ())
+        else:
+            row, subdirs = self._list_dir(rel, st)
+            rows.append(row)
+            if is_album:
+                return
+
+        for name in subdirs:
+            child = f"{rel}/{name}"
+            try:
+                child_st = os.stat(os.path.join(self.root, child))
+            except OSError:
+                continue
+            self._walk(child, child_st, known, children, rows, seen, force)
+
+    def refresh(self, artist=None, full=False, force_path=None):
+        """
+        Revarre /music inteiro (ou só a pasta `artist`). full=True relista tudo;
+        force_path relista só aquela pasta (relativa a /music), mesmo com o mtime igual.
+        Retorna {'dirs', 'listed', 'removed', 'changed': [pastas relistadas],
+        'gone': [pastas que saíram do índice]} ou None se /music não existir.
+        """
+        with self.lock:
+            started = time.monotonic()
+            if artist is None:
+                known_rows = self.db.query("SELECT path, mtime, inode FROM library_dirs")
+            else:
+                known_rows = self.db.query("SELECT path, mtime, inode FROM library_dirs WHERE path=? OR parent=?", (artist, artist))
+            known = {r['path']: (r['mtime'], r['inode']) for r in known_rows}
+            children = {}
+            for path in known:
+                parent, _, name = path.rpartition('/')
+                if parent:
+                    children.setdefault(parent, []).append(name)
+            rows, seen = [], set()
+
+            try:
+                if artist is None:
+                    with os.scandir(self.root) as it:
+                        tops = [(e.name, e.stat()) for e in it if not e.name.startswith('.') and e.is_dir()]
+                else:
+                    tops = [(artist, os.stat(os.path.join(self.root, artist)))]
+            except FileNotFoundError:
+                tops = []
+                if artist is None:
+                    return None
+
+            for name, st in tops:
+                try:
+                    self._walk(name, st, known, children, rows, seen, True if full else force_path)
+                except OSError as e:
+                    # Erro de leitura (ex.: storage de rede instável) não apaga nada: fica o que já estava indexado
+                    seen.add(name)
+                    seen.update(f"{name}/{child}" for child in children.get(name, ()))
+                    sys_logger.log("LIBRARY", f"⚠️ Falha ao ler {name}: {e}")
+
+            removed = [path for path in known if path not in seen]
+            with self.db.transaction():
+                self.db.executemany(
+                    """INSERT OR REPLACE INTO library_dirs
+                       (path, parent, name, inode, mtime, size, track_count, audio_format, image)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+                self.db.executemany("DELETE FROM library_dirs WHERE path=?", [(p,) for p in removed])
+
+            if artist is None:
+                self.refreshed_at = time.monotonic()
+                if rows or removed:
+                    sys_logger.log("LIBRARY", f"📂 Índice de /music: {len(seen)} pastas, {len(rows)} relistadas, "
+                                              f"{len(removed)} removidas ({time.monotonic() - started:.1f}s).")
+            return {'dirs': len(seen), 'listed': len(rows), 'removed': len(removed),
+                    'changed': [row[0] for row in rows], 'gone': removed}
+
+    def refresh_path(self, path):
+        """Atualiza o índice depois de mexer numa pasta (caminho absoluto dentro de /music)."""
+        rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+        if rel == '.' or rel.startswith('..'):
+            return None
+        return self.refresh(artist=rel.split('/')[0], force_path=rel)
+
+    def ensure_fresh(self, max_age=None):
+        """Revarredura incremental se a última tiver mais de max_age segundos (sem watcher ativo)."""
+        if self.watched:
+            return
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= (self.MAX_AGE if max_age is None else max_age):
+            self.refresh()
+
+    # --- CONSULTAS ---
+
+    def artists(self):
+        return self.db.query("SELECT * FROM library_dirs WHERE parent='' ORDER BY name")
+
+    def albums(self, artist_folder):
+        return self.db.query("SELECT * FROM library_dirs WHERE parent=? ORDER BY name", (artist_folder,))
+
+    def album(self, artist_folder, album_folder):
+        return self.db.query("SELECT * FROM library_dirs WHERE path=?", (f"{artist_folder}/{album_folder}",), one=True)
+
+    def artist_image(self, artist_folder):
+        """Caminho da foto do artista dentro de /music (folder.jpg, cover.jpg...) ou None."""
+        row = self.db.query("SELECT image FROM library_dirs WHERE path=?", (artist_folder,), one=True)
+        return os.path.join(self.root, artist_folder, row['image']) if row and row['image'] else None
@@ -0,0 +1,369 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from .logger import sys_logger
+from .deezer_http import DeezerAPIError
+from .album_matcher import AlbumMatcher
+
+
+class Inotify:
+    """Acesso mínimo ao inotify do Linux via libc (sem dependência extra)."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    EVENT = struct.Struct("iIII")   # wd, mask, cookie, len (seguido do nome)
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Eventos disponíveis em até `timeout` segundos: [(wd, mask, nome)]."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, pos = [], 0
+        while pos < len(data):
+            wd, mask, _, size = self.EVENT.unpack_from(data, pos)
+            pos += self.EVENT.size
+            name = os.fsdecode(data[pos:pos + size].rstrip(b"\0"))
+            pos += size
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher(threading.Thread):
+    """
+    Modo watch (opcional, Linux): acompanha /music pelo inotify em vez de
+    esperar um scan. Os eventos são agrupados (DEBOUNCE segundos sem novidade,
+    no máximo MAX_BATCH_DELAY), o LibraryIndex é atualizado só nas pastas de
+    artista afetadas e a fila é reconciliada com o que mudou:
+    - álbum 'completed' cuja pasta sumiu (ou esvaziou) volta para 'pending';
+    - pasta nova de um artista da biblioteca é ligada ao álbum pendente
+      correspondente, ou ao álbum da discografia (entra como 'completed').
+    Sem inotify (limite de watches/instâncias esgotado, outro SO) cai para
+    revarreduras incrementais a cada POLL_INTERVAL, com a mesma reconciliação.
+    """
+    DEBOUNCE = 5
+    MAX_BATCH_DELAY = 60
+    POLL_INTERVAL = 300
+    # Mais que isso sumindo de uma vez parece storage desmontado, não exclusão
+    MAX_REOPEN_BATCH = 200
+    MASK = (Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO |
+            Inotify.IN_CLOSE_WRITE | Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF | Inotify.IN_ONLYDIR)
+
+    def __init__(self, db, library, metadata_provider, downloader):
+        super().__init__(name="LibraryWatcher")
+        self.db = db
+        self.library = library
+        self.metadata = metadata_provider
+        self.downloader = downloader
+        self.daemon = True
+        self.inotify = None
+        self.wds = {}     # wd -> pasta relativa ('' = /music)
+        self.paths = {}   # pasta relativa -> wd
+
+    # --- INOTIFY ---
+
+    def _watch(self, rel):
+        try:
+            wd = self.inotify.add_watch(os.path.join(self.library.root, rel) if rel else self.library.root, self.MASK)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return   # sumiu antes de ser observada; o refresh do lote resolve
+            raise
+        self.wds[wd] = rel
+        self.paths[rel] = wd
+
+    def _watch_tree(self, rel):
+        """Observa a pasta e as subpastas até o nível de álbum (Artista/Álbum)."""
+        self._watch(rel)
+        if '/' in rel:
+            return
+        try:
+            with os.scandir(os.path.join(self.library.root, rel)) as it:
+                subdirs = [e.name for e in it if e.is_dir() and not e.name.startswith('.')]
+        except OSError:
+            return
+        for name in subdirs:
+            self._watch(f"{rel}/{name}")
+
+    def _unwatch_tree(self, rel):
+        for path in [p for p in self.paths if p == rel or p.startswith(rel + '/')]:
+            wd = self.paths.pop(path)
+            self.wds.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def _sync_watches(self, result):
+        """
+        Acompanha um refresh: pastas que entraram no índice sem evento observado
+        (criadas com o app parado, ou perdidas num estouro da fila) ganham watch;
+        as que saíram perdem o seu (renomeada, seria reportada com o nome antigo).
+        """
+        if self.inotify is None or not result:
+            return
+        for path in result['gone']:
+            if path in self.paths:
+                self._unwatch_tree(path)
+        for path in result['changed']:
+            if path not in self.paths:
+                self._watch(path)
+
+    def _handle(self, wd, mask, name, dirty):
+        """Traduz um evento em pasta de artista suja. Retorna True se a fila do kernel estourou."""
+        if mask & Inotify.IN_Q_OVERFLOW:
+            return True
+        rel = self.wds.get(wd)
+        if rel is None:
+            return False
+        if mask & Inotify.IN_IGNORED:
+            # Watch removido pelo kernel (pasta apagada)
+            self.wds.pop(wd, None)
+            if self.paths.get(rel) == wd:
+                del self.paths[rel]
+            return False
+
+        target = f"{rel}/{name}" if rel and name else (rel or name)
+        if not target:
+            return False
+        dirty.add(target.split('/')[0])
+
+        if mask & Inotify.IN_ISDIR and target.count('/') <= 1:
+            if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                self._watch_tree(target)
+            elif mask & Inotify.IN_MOVED_FROM:
+                # Watch segue o inode: renomeada, a pasta seria reportada com o nome antigo
+                self._unwatch_tree(target)
+        return False
+
+    def _watch_loop(self):
+        self.inotify = Inotify()
+        try:
+            self._watch('')
+            for row in self.db.query("SELECT path FROM library_dirs"):
+                self._watch(row['path'])
+            # O que mudou com o app parado (ou antes dos watches existirem)
+            self._apply(self.library.refresh())
+            self.library.watched = True
+            sys_logger.log("WATCH", f"👀 Monitorando /music via inotify ({len(self.wds)} pastas).")
+
+            dirty, overflow, first, last = set(), False, None, None
+            while True:
+                timeout = None
+                if first is not None:
+                    timeout = max(0, min(last + self.DEBOUNCE, first + self.MAX_BATCH_DELAY) - time.monotonic())
+
+                for wd, mask, name in self.inotify.read(timeout):
+                    overflow = self._handle(wd, mask, name, dirty) or overflow
+                    last = time.monotonic()
+                    first = first or last
+
+                if first is None or time.monotonic() < min(last + self.DEBOUNCE, first + self.MAX_BATCH_DELAY):
+                    continue
+
+                if overflow:
+                    sys_logger.log("WATCH", "⚠️ Fila do inotify estourou; revarrendo /music.")
+                    self._apply(self.library.refresh())
+                else:
+                    self._apply_artists(dirty)
+                dirty, overflow, first, last = set(), False, None, None
+        finally:
+            self.library.watched = False
+            self.inotify.close()
+            self.inotify = None
+            self.wds, self.paths = {}, {}
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                self._apply(self.library.refresh())
+            except Exception as e:
+                sys_logger.log("ERROR", f"Falha na revarredura de /music: {e}")
+
+    def run(self):
+        try:
+            self._watch_loop()
+        except (OSError, AttributeError) as e:
+            if getattr(e, 'errno', None) in (errno.ENOSPC, errno.EMFILE):
+                reason = "limite de watches do inotify esgotado (fs.inotify.max_user_watches/max_user_instances)"
+            else:
+                reason = f"inotify indisponível ({e})"
+            sys_logger.log("WATCH", f"⚠️ {reason}. Revarrendo /music a cada {self.POLL_INTERVAL // 60} min.")
+        except Exception as e:
+            sys_logger.log("ERROR", f"Falha no monitoramento de /music: {e}")
+        self._poll_loop()
+
+    # --- RECONCILIAÇÃO ---
+
+    def _apply_artists(self, artists):
+        changed, gone = [], []
+        for artist in artists:
+            result = self.library.refresh(artist=artist)
+            self._sync_watches(result)
+            changed += result['changed']
+            gone += result['gone']
+        self.reconcile(changed, gone)
+
+    def _apply(self, result):
+        self._sync_watches(result)
+        if result:
+            self.reconcile(result['changed'], result['gone'])
+
+    def reconcile(self, changed, gone):
+        """Leva para a fila o que mudou no índice (pastas relativas a /music)."""
+        gone_albums = {p for p in gone if '/' in p}
+        present = {}
+        for path in changed:
+            if '/' not in path:
+                continue
+            row = self.library.album(*path.split('/', 1))
+            if row is None:
+                continue
+            if row['track_count']:
+                present[path] = row['track_count']
+            else:
+                gone_albums.add(path)
+        if not gone_albums and not present:
+            return
+
+        names = {r['artist'] for r in self.db.query("SELECT DISTINCT artist FROM queue")}
+        names |= {r['name'] for r in self.db.query("SELECT name FROM artists")}
+        by_folder = {self.downloader.sanitize(n): n for n in names if n}
+
+        if len(gone_albums) > self.MAX_REOPEN_BATCH:
+            sys_logger.log("WATCH", f"⚠️ {len(gone_albums)} álbuns sumiram de /music de uma vez (storage desmontado?). "
+                                    "Nada foi reaberto na fila.")
+            gone_albums = set()
+
+        by_artist = {}
+        for path in gone_albums:
+            folder, album = path.split('/', 1)
+            if folder in by_folder:
+                by_artist.setdefault(by_folder[folder], ({}, set()))[1].add(album)
+        for path, count in present.items():
+            folder, album = path.split('/', 1)
+            if folder in by_folder:
+                by_artist.setdefault(by_folder[folder], ({}, set()))[0][album] = count
+
+        reopened = linked = 0
+        for artist, (found, lost) in by_artist.items():
+            try:
+                r, l = self._reconcile_artist(artist, found, lost)
+                reopened += r
+                linked += l
+            except Exception as e:
+                sys_logger.log("ERROR", f"Falha ao reconciliar {artist}: {e}")
+        if reopened or linked:
+            sys_logger.log("WATCH", f"🔄 /music mudou: {reopened} álbuns de volta à fila, {linked} vinculados.")
+
+    def _set_status(self, qid, status, only_from):
+        """Muda álbum e faixas juntos, só se o álbum ainda estiver num dos status esperados."""
+        marks = ",".join("?" * len(only_from))
+        with self.db.transaction():
+            cur = self.db.execute(f"UPDATE queue SET status=? WHERE id=? AND status IN ({marks})", (status, qid, *only_from))
+            if cur.rowcount != 1:
+                return False
+            self.db.execute("UPDATE tracks SET status=? WHERE queue_id=? AND status != ?", (status, qid, status))
+        return True
+
+    def _reconcile_artist(self, artist, found, lost):
+        """found: {pasta do álbum: nº de faixas no disco}; lost: pastas que sumiram."""
+        rows = self.db.query("SELECT * FROM queue WHERE artist=?", (artist,))
+        by_folder = {self.downloader.sanitize(r['title']): r for r in rows}
+        reopened = linked = 0
+
+        # Primeiro o que sumiu: numa renomeação, o álbum reaberto é religado logo abaixo
+        for album in lost:
+            row = by_folder.get(album)
+            if row and row['status'] == 'completed' and self._set_status(row['id'], 'pending', ('completed',)):
+                sys_logger.log("WATCH", f"🗑️ Sumiu do disco, de volta à fila: {row['title']} - {artist}")
+                reopened += 1
+
+        # Pastas com o nome exato de um álbum já baixado/em download não são novidade
+        rows = self.db.query("SELECT * FROM queue WHERE artist=? AND status IN ('pending', 'error')", (artist,))
+        new_folders = [f for f in found if f not in by_folder or by_folder[f]['status'] in ('pending', 'error')]
+        if not new_folders:
+            return reopened, linked
+
+        used = set()
+        for pos, folder in AlbumMatcher(new_folders).match([r['title'] for r in rows]).items():
+            row = rows[pos]
+            expected = self.db.query("SELECT count(*) as c FROM tracks WHERE queue_id=?", (row['id'],), one=True)['c']
+            used.add(folder)
+            if found[folder] < expected:
+                sys_logger.log("WATCH", f"⚠️ Incompleto no disco ({found[folder]}/{expected}): {row['title']} - {artist}")
+                continue
+            if self._set_status(row['id'], 'completed', ('pending', 'error')):
+                sys_logger.log("WATCH", f"📚 Encontrado no disco: {row['title']} - {artist}")
+                linked += 1
+
+        leftover = [f for f in new_folders if f not in used]
+        if leftover:
+            linked += self._link_from_discography(artist, {f: found[f] for f in leftover})
+        return reopened, linked
+
+    def _link_from_discography(self, artist, found):
+        """Pastas sem álbum na fila: procura na discografia do artista (como a importação)."""
+        art = self.db.query("SELECT * FROM artists WHERE name=?", (artist,), one=True)
+        if not art:
+            return 0
+        try:
+            albums = self.metadata.get_discography(art['deezer_id'], target_artist_id=artist, album_filter=self.db.settings.album_filter)
+        except DeezerAPIError:
+            sys_logger.log("WATCH", f"⚠️ Discografia indisponível: {artist}")
+            return 0
+
+        folders = list(found)
+        linked_to = AlbumMatcher(folders).match([a['title'] for a in albums])
+        known = self.db.existing_album_ids(albums[pos]['deezer_id'] for pos in linked_to)
+        matched = [(albums[pos], folder) for pos, folder in sorted(linked_to.items()) if albums[pos]['deezer_id'] not in known]
+        if not matched:
+            return 0
+
+        tracklists = self.metadata.get_albums_tracks([a['deezer_id'] for a, _ in matched], fallback_artist=artist)
+        linked = 0
+        for album, folder in matched:
+            tracks = tracklists.get(album['deezer_id'])
+            if tracks is None:
+                continue
+            # Mesma regra do scheduler: completo no disco entra como baixado, senão vai para a fila
+            status = 'completed' if found[folder] >= len(tracks) else 'pending'
+            if self.db.add_album(album, artist, tracks, status=status):
+                sys_logger.log("WATCH", f"📚 Vinculado do disco ({status}): {album['title']} - {artist}")
+                linked += 1
+        return linked
@@ -37,23 +37,12 @@ class LibraryMaintenance:
                 if missing_tracks:
                     sys_logger.log("MAINTAIN", f"⚠️ Álbum incompleto: {album['title']} (Faltam {len(missing_tracks)} faixas). Reparando...")
                     
-                    # Adiciona as faixas faltantes na tabela tracks
-                    for t in missing_tracks:
-                        # Verifica se já não existe como 'pending' ou 'error' para não duplicar
-                        exists_pending = self.db.query(
-                            "SELECT 1 FROM tracks WHERE queue_id=? AND deezer_id=?", 
-                            (album['id'], t['deezer_id']), 
-                            one=True
-                        )
-                        
-                        if not exists_pending:
-                            self.db.execute(
-                                "INSERT INTO tracks (queue_id, deezer_id, title, artist, track_number, status) VALUES (?, ?, ?, ?, ?, 'pending')",
-                                (album['id'], t['deezer_id'], t['title'], t['artist'], t['track_num'])
-                            )
-                    
-                    # Reabre o álbum na fila para o Worker processar
-                    self.db.execute("UPDATE queue SET status='pending' WHERE id=?", (album['id'],))
+                    # Adiciona as faixas faltantes e reabre o álbum numa única transação.
+                    # ON CONFLICT mantém as que já existem como 'pending' ou 'error' (sem duplicar)
+                    with self.db.transaction():
+                        self.db.add_tracks(album['id'], missing_tracks, status='pending')
+                        # Reabre o álbum na fila para o Worker processar
+                        self.db.execute("UPDATE queue SET status='pending' WHERE id=?", (album['id'],))
                     repaired_count += 1
                     
                 # Opcional: Pausa curta para não bombardear a API se tiver muitos álbuns
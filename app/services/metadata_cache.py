@@ -0,0 +1,131 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import urlencode
+
+from ..database import Database
+from .logger import sys_logger
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class MetadataCache:
+    """
+    Cache persistente (SQLite em /config) das respostas da API do Deezer.
+    TTL por tipo de endpoint: tracklists quase nunca mudam, discografias e
+    buscas sim. Limitado por número de entradas, com remoção LRU.
+    """
+    # (tipo, regex do caminho, TTL em segundos) — primeiro que casar vale
+    ENDPOINT_TTLS = (
+        ('album_tracks', re.compile(r"^/album/\d+/tracks$"), 30 * DAY),
+        ('album', re.compile(r"^/album/\d+$"), 30 * DAY),
+        ('discography', re.compile(r"^/artist/\d+/albums$"), 6 * HOUR),
+        ('related', re.compile(r"^/artist/\d+/related$"), 7 * DAY),
+        ('artist', re.compile(r"^/artist/\d+$"), DAY),
+        ('search', re.compile(r"^/search/"), HOUR),
+    )
+    DEFAULT_TTL = HOUR
+    # last_access só é regravado se a entrada não foi lida nos últimos N segundos
+    TOUCH_INTERVAL = 300
+
+    def __init__(self, db_path, max_entries=50000):
+        self.db = Database(db_path)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+        self._puts = 0
+
+        with self.db.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT,
+                payload TEXT,
+                expires_at REAL,
+                last_access REAL
+            )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+
+    @staticmethod
+    def make_key(endpoint, params=None):
+        if not params:
+            return endpoint
+        sep = '&' if '?' in endpoint else '?'
+        return f"{endpoint}{sep}{urlencode(sorted((k, str(v)) for k, v in params.items()))}"
+
+    def classify(self, endpoint):
+        path = endpoint.split('?', 1)[0]
+        for kind, pattern, ttl in self.ENDPOINT_TTLS:
+            if pattern.match(path):
+                return kind, ttl
+        return 'other', self.DEFAULT_TTL
+
+    def _count(self, counter, kind):
+        with self.lock:
+            counter[kind] = counter.get(kind, 0) + 1
+
+    def get(self, endpoint, params=None):
+        key = self.make_key(endpoint, params)
+        kind, _ = self.classify(endpoint)
+        now = time.time()
+
+        row = self.db.query("SELECT payload, expires_at, last_access FROM cache WHERE key=?", (key,), one=True)
+        if not row or row['expires_at'] < now:
+            self._count(self.misses, kind)
+            return None
+
+        if now - row['last_access'] > self.TOUCH_INTERVAL:
+            self.db.execute("UPDATE cache SET last_access=? WHERE key=?", (now, key))
+        self._count(self.hits, kind)
+        return json.loads(row['payload'])
+
+    def put(self, endpoint, params, data):
+        key = self.make_key(endpoint, params)
+        kind, ttl = self.classify(endpoint)
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO cache (key, kind, payload, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, kind, json.dumps(data), now + ttl, now)
+        )
+
+        with self.lock:
+            self._puts += 1
+            check = self._puts % 200 == 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Remove expirados e, se passar do limite, os menos acessados (LRU)."""
+        with self.db.transaction():
+            self.db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            total = self.db.query("SELECT COUNT(*) as c FROM cache", one=True)['c']
+            excess = total - self.max_entries
+            if excess > 0:
+                # Folga de 10% para não despejar a cada inserção
+                excess += self.max_entries // 10
+                self.db.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)",
+                    (excess,)
+                )
+                sys_logger.log("CACHE", f"🧹 Cache de metadados: {excess} entradas antigas removidas.")
+
+    def invalidate(self, endpoint, params=None):
+        self.db.execute("DELETE FROM cache WHERE key=?", (self.make_key(endpoint, params),))
+
+    def stats(self):
+        with self.lock:
+            hits, misses = dict(self.hits), dict(self.misses)
+        total_hits, total_misses = sum(hits.values()), sum(misses.values())
+        lookups = total_hits + total_misses
+        return {
+            'entries': self.db.query("SELECT COUNT(*) as c FROM cache", one=True)['c'],
+            'hits': total_hits,
+            'misses': total_misses,
+            'hit_rate': round(total_hits / lookups, 3) if lookups else 0.0,
+            'by_kind': {
+                kind: {'hits': hits.get(kind, 0), 'misses': misses.get(kind, 0)}
+                for kind in sorted(set(hits) | set(misses))
+            },
+        }
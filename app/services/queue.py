@@ -3,54 +3,235 @@ import time
 import os
 import shutil
 import random
-from collections import defaultdict
+from collections import OrderedDict, deque
 from .logger import sys_logger
 
+class AlbumRotation:
+    """
+    Índice em memória dos álbuns pendentes para o rodízio do Worker.
+    Um deque de IDs por artista + lista de artistas para sorteio O(1).
+    Carrega a fila uma vez; depois só lê álbuns novos (id acima do último visto).
+    Álbuns apagados/alterados são descartados no claim; reabertos forçam recarga
+    (detectado pelo contador de pendentes mantido por trigger).
+    """
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.busy = set()             # artistas com álbum em download (exclusividade entre workers)
+        self._reset()
+
+    def _reset(self):
+        self.by_artist = {}           # artista -> deque de queue_id (mais antigo primeiro)
+        self.order = OrderedDict()    # artistas por ordem do álbum pendente mais antigo
+        self.artists = []             # mesma coleção, indexável para o sorteio
+        self.pos = {}                 # artista -> índice em self.artists
+        self.size = 0
+        self.last_id = 0
+
+    def _push(self, qid, artist):
+        q = self.by_artist.get(artist)
+        if q is None:
+            q = self.by_artist[artist] = deque()
+            self.order[artist] = None
+            self.pos[artist] = len(self.artists)
+            self.artists.append(artist)
+        q.append(qid)
+        self.size += 1
+
+    def _drop_artist(self, artist):
+        del self.by_artist[artist]
+        del self.order[artist]
+        # Remove da lista trocando com o último (O(1))
+        i = self.pos.pop(artist)
+        tail = self.artists.pop()
+        if tail != artist:
+            self.artists[i] = tail
+            self.pos[tail] = i
+
+    def _load_range(self, after_id, upto_id):
+        rows = self.db.query(
+            "SELECT id, artist FROM queue WHERE id > ? AND id <= ? AND status='pending' ORDER BY id ASC",
+            (after_id, upto_id)
+        )
+        for r in rows:
+            self._push(r['id'], r['artist'])
+
+    def sync(self):
+        """Incorpora álbuns enfileirados desde a última chamada."""
+        with self.lock:
+            top = self.db.query("SELECT MAX(id) as m FROM queue", one=True)['m'] or 0
+            if not self.loaded:
+                self._reset()
+                self._load_range(0, top)
+                self.loaded = True
+            elif top > self.last_id:
+                self._load_range(self.last_id, top)
+            self.last_id = max(self.last_id, top)
+
+            # Álbuns antigos que voltaram para 'pending' (manutenção, destravar) não
+            # aparecem pelo id: se o banco tem mais pendentes que o índice, recarrega.
+            if self.db.count_queue('pending') > self.size:
+                self._reset()
+                self._load_range(0, top)
+                self.last_id = top
+
+    def _pick_artist(self, last_artist):
+        n = len(self.artists)
+        free = n - sum(1 for a in self.busy if a in self.pos)
+        if free <= 0:
+            return None
+
+        if free > 1 and last_artist in self.pos and last_artist not in self.busy:
+            # Sorteio entre os outros artistas livres (rejeição: busy tem no máx. N workers)
+            for _ in range(8):
+                i = random.randrange(n - 1)
+                if i >= self.pos[last_artist]:
+                    i += 1
+                if self.artists[i] not in self.busy:
+                    return self.artists[i]
+            others = [a for a in self.artists if a != last_artist and a not in self.busy]
+            return random.choice(others)
+
+        return next(a for a in self.order if a not in self.busy)
+
+    def next_album(self, last_artist=None):
+        """
+        Rodízio: sorteia um artista diferente do anterior (se houver outro);
+        senão pega o artista com o álbum pendente mais antigo.
+        Artistas em download por outro worker ficam de fora até release().
+        Retorna (queue_id, artista) ou None.
+        """
+        with self.lock:
+            artist = self._pick_artist(last_artist)
+            if artist is None:
+                return None
+
+            q = self.by_artist[artist]
+            qid = q.popleft()
+            self.size -= 1
+            if not q:
+                self._drop_artist(artist)
+            self.busy.add(artist)
+            return qid, artist
+
+    def release(self, artist):
+        """Libera o artista para outros workers (fim do álbum ou claim descartado)."""
+        with self.lock:
+            self.busy.discard(artist)
+
+
 class QueueWorker(threading.Thread):
-    def __init__(self, db, metadata_provider, downloader):
+    def __init__(self, db, metadata_provider, downloader, rotation=None, library=None):
         super().__init__()
         self.db = db
         self.metadata = metadata_provider
         self.downloader = downloader
+        self.library = library
         self.daemon = True
         self.session_downloads = 0
         self.max_session = random.randint(40, 60)
         self.last_artist = None # Memória para o rodízio
+        self.current_artist = None # Artista reservado no rodízio (exclusivo deste worker)
+        # Compartilhado entre os workers do pool: é ele que garante um artista por worker
+        self.rotation = rotation or AlbumRotation(db)
 
     def _get_next_smart_album(self):
         """
-        Lógica de Rodízio:
-        1. Pega todos os álbuns pendentes.
-        2. Agrupa por artista.
-        3. Tenta escolher um artista diferente do anterior.
-        4. Retorna o primeiro álbum pendente desse artista.
+        Lógica de Rodízio (via AlbumRotation, sem reler a fila inteira):
+        1. Incorpora álbuns novos ao índice em memória.
+        2. Tenta escolher um artista diferente do anterior.
+        3. Reserva (claim) o primeiro álbum pendente desse artista.
+        4. Retorna a linha do álbum já marcada como 'downloading'.
+        O artista fica reservado para este worker até _release_artist().
         """
-        pending_albums = self.db.query("SELECT * FROM queue WHERE status='pending' ORDER BY id ASC")
-        
-        if not pending_albums:
-            return None
+        self.rotation.sync()
+
+        while True:
+            picked = self.rotation.next_album(self.last_artist)
+            if not picked:
+                return None
+
+            qid, artist = picked
+            # Claim atômico: se o álbum foi apagado/alterado desde que entrou no índice, descarta
+            cur = self.db.execute("UPDATE queue SET status='downloading' WHERE id=? AND status='pending'", (qid,))
+            if cur.rowcount != 1:
+                self.rotation.release(artist)
+                continue
+
+            self.current_artist = artist
+            album = self.db.query("SELECT * FROM queue WHERE id=?", (qid,), one=True)
+            self.last_artist = album['artist']
+            return album
+
+    def _move_files(self, files, final_dir):
+        moved = 0
+        for fp in files:
+            try:
+                dest = os.path.join(final_dir, os.path.basename(fp))
+                if os.path.exists(dest): os.remove(dest)
+                shutil.move(fp, dest)
+                moved += 1
+            except: pass
+        return moved
+
+    def _use_album_mode(self, album_info, pending_count):
+        """Modo álbum só para álbuns novos; reparos (parte já baixada) vão faixa a faixa."""
+        if self.db.settings.get('download_mode') != 'album':
+            return False
+        if not album_info['deezer_id']:
+            return False
+        total = self.db.query("SELECT count(*) as c FROM tracks WHERE queue_id=?", (album_info['id'],), one=True)['c']
+        return pending_count == total
+
+    def _download_album(self, album_info, tracks, temp_dir, final_dir):
+        """
+        Baixa o álbum com um único download do deemix e grava o resultado em cada
+        linha de tracks. Retorna as faixas não identificadas (para o modo por faixa).
+        """
+        ids = [t['id'] for t in tracks]
+        marks = ",".join("?" * len(ids))
+        self.db.execute(f"UPDATE tracks SET status='downloading' WHERE id IN ({marks})", ids)
+
+        metas = [{
+            "deezer_id": t['deezer_id'],
+            "title": t['title'],
+            "artist": t['artist'] or album_info['artist'],
+            "album_artist": album_info['artist'],
+            "track_num": t['track_number']
+        } for t in tracks]
+
+        files, errors = self.downloader.download_album(album_info['deezer_id'], metas, temp_dir)
+
+        leftover = []
+        done = 0
+        with self.db.transaction():
+            for t in tracks:
+                tid = str(t['deezer_id'])
+                if tid in files:
+                    status = 'completed' if self._move_files(files[tid], final_dir) > 0 else 'error'
+                elif tid in errors:
+                    status = 'error'
+                else:
+                    status = 'pending'
+                    leftover.append(t)
+                self.db.execute("UPDATE tracks SET status=? WHERE id=?", (status, t['id']))
+                if status == 'completed':
+                    done += 1
 
-        # Agrupa
-        groups = defaultdict(list)
-        for alb in pending_albums:
-            groups[alb['artist']].append(alb)
-        
-        candidates = list(groups.keys())
-        
-        # Tenta mudar de artista
-        chosen_artist = candidates[0]
-        if len(candidates) > 1 and self.last_artist in candidates:
-            others = [a for a in candidates if a != self.last_artist]
-            if others:
-                chosen_artist = random.choice(others)
-        
-        self.last_artist = chosen_artist
-        
-        # Retorna o primeiro álbum da fila deste artista
-        return groups[chosen_artist][0]
+        self.session_downloads += done
+        sys_logger.log("SUCCESS" if done else "WORKER", f"💿 Álbum: {done}/{len(tracks)} faixas baixadas ({album_info['title']})")
+        if leftover:
+            sys_logger.log("WORKER", f"↪️ {len(leftover)} faixa(s) seguem no modo por faixa.")
+        return leftover
+
+    def _release_artist(self):
+        if self.current_artist is not None:
+            self.rotation.release(self.current_artist)
+            self.current_artist = None
 
     def run(self):
-        sys_logger.log("WORKER", "⚡ Modo Turbo-Stealth (Smart Shuffle) Iniciado")
+        sys_logger.log("WORKER", f"⚡ Modo Turbo-Stealth (Smart Shuffle) Iniciado [{self.name}]")
 
         while True:
             try:
@@ -63,8 +244,6 @@ class QueueWorker(threading.Thread):
 
                 qid = album_info['id']
                 
-                # Marca álbum como baixando
-                self.db.execute("UPDATE queue SET status='downloading' WHERE id=?", (qid,))
                 sys_logger.log("WORKER", f"🎲 Sorteado: {album_info['artist']}")
                 sys_logger.log("WORKER", f"📥 Iniciando: {album_info['title']}")
 
@@ -82,6 +261,10 @@ class QueueWorker(threading.Thread):
                 tracks = self.db.query("SELECT * FROM tracks WHERE queue_id=? AND status='pending'", (qid,))
                 track_count = len(tracks)
 
+                # Álbum inteiro de uma vez; o que não for resolvido segue no modo por faixa
+                if tracks and self._use_album_mode(album_info, track_count):
+                    tracks = self._download_album(album_info, tracks, temp_dir, final_dir)
+
                 for track in tracks:
                     # Verifica cancelamento
                     if not self.db.query("SELECT id FROM tracks WHERE id=?", (track['id'],), one=True):
@@ -104,14 +287,7 @@ class QueueWorker(threading.Thread):
                     downloaded_files = self.downloader.download_track(meta, temp_dir)
 
                     if downloaded_files:
-                        moved = 0
-                        for fp in downloaded_files:
-                            try:
-                                dest = os.path.join(final_dir, os.path.basename(fp))
-                                if os.path.exists(dest): os.remove(dest)
-                                shutil.move(fp, dest)
-                                moved += 1
-                            except: pass
+                        moved = self._move_files(downloaded_files, final_dir)
 
                         status = 'completed' if moved > 0 else 'error'
                         self.db.execute("UPDATE tracks SET status=? WHERE id=?", (status, t_data['id']))
@@ -139,6 +315,12 @@ class QueueWorker(threading.Thread):
                 try: os.rmdir(temp_dir)
                 except: pass
 
+                if self.library:
+                    self.library.refresh_path(final_dir)
+
+                # Libera o artista para os outros workers antes da pausa
+                self._release_artist()
+
                 # 5. Pausa Inteligente entre Álbuns (Troca de Artista)
                 wait = random.randint(15, 30)
                 if self.session_downloads > self.max_session:
@@ -151,5 +333,6 @@ class QueueWorker(threading.Thread):
                 time.sleep(wait)
 
             except Exception as e:
+                self._release_artist()
                 sys_logger.log("ERROR", f"Worker Crash: {e}")
                 time.sleep(10)
\ No newline at end of file
@@ -1,46 +1,128 @@
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .logger import sys_logger
-
-MUSIC_LIB_DIR = "/music"
+from .deezer_http import DeezerAPIError
 
 class LibraryScanner:
-    def __init__(self, metadata_provider):
+    """
+    Scan de /music em background: cada pasta de artista é resolvida no Deezer
+    com concorrência limitada, e a página de Ajustes acompanha o progresso e
+    os resultados parciais via status(since). As resoluções ficam em
+    folder_resolutions (chave: nome da pasta + mtime), então um novo scan só
+    consulta pastas novas ou alteradas.
+    """
+    SCAN_CONCURRENCY = 4
+
+    def __init__(self, metadata_provider, db, library):
         self.metadata = metadata_provider
+        self.db = db
+        self.library = library
+        self.lock = threading.Lock()
+        self.thread = None
+        self._reset()
+
+    def _reset(self):
+        self.running = False
+        self.error = None
+        self.total = 0
+        self.cached = 0
+        self.results = []
+
+    def start(self):
+        """Inicia um scan se nenhum estiver rodando. Retorna False se já havia um."""
+        with self.lock:
+            if self.running:
+                return False
+            self._reset()
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="LibraryScan", daemon=True)
+        self.thread.start()
+        return True
 
-    def scan_folders(self):
-        """
-        Lê as pastas em /music e tenta adivinhar o artista.
-        Retorna uma lista de candidatos para o usuário aprovar.
-        """
-        if not os.path.exists(MUSIC_LIB_DIR):
-            return {"error": "Diretório /music não encontrado"}
-
-        folders = [f for f in os.listdir(MUSIC_LIB_DIR) if os.path.isdir(os.path.join(MUSIC_LIB_DIR, f))]
-        folders.sort()
-
-        candidates = []
-        
-        for folder_name in folders:
-            if folder_name.startswith('.'): continue 
-
-            sys_logger.log("SCAN", f"Analisando pasta: {folder_name}")
-            
-            result = self.metadata.search_artist(folder_name)
-            
-            candidate = {
-                "folder": folder_name,
-                "detected_name": "Desconhecido",
-                "deezer_id": "",
-                "status": "not_found",
-                "image": ""
+    def status(self, since=0):
+        """Progresso + resultados a partir do índice `since` (o cliente pede só o que falta)."""
+        with self.lock:
+            return {
+                "running": self.running,
+                "error": self.error,
+                "total": self.total,
+                "done": len(self.results),
+                "cached": self.cached,
+                "results": self.results[since:],
             }
 
-            if result:
-                candidate["detected_name"] = result['name']
-                candidate["deezer_id"] = result['id']
-                candidate["image"] = result['image']
-                candidate["status"] = "found"
-            
-            candidates.append(candidate)
+    def _list_folders(self):
+        # Scan pedido pelo usuário: atualiza o índice de /music (incremental) e lista dele
+        if self.library.refresh() is None:
+            return None
+        return [(row['name'], row['mtime']) for row in self.library.artists()]
+
+    def _resolve(self, folder_name, mtime, cache):
+        """Lê o cache ou busca no Deezer. Retorna (candidato, veio_do_cache)."""
+        candidate = {
+            "folder": folder_name,
+            "detected_name": "Desconhecido",
+            "deezer_id": "",
+            "status": "not_found",
+            "image": ""
+        }
+
+        hit = cache.get(folder_name)
+        if hit is not None and hit['mtime'] == mtime:
+            if hit['status'] == 'found':
+                candidate.update(detected_name=hit['name'], deezer_id=hit['deezer_id'], image=hit['image_url'] or "", status="found")
+            return candidate, True
+
+        try:
+            result = self.metadata.search_artist(folder_name, strict=True)
+        except DeezerAPIError:
+            # Falha de rede/cota não entra no cache: o próximo scan tenta de novo
+            candidate["status"] = "error"
+            return candidate, False
+
+        if result:
+            candidate.update(detected_name=result['name'], deezer_id=result['id'], image=result['image'] or "", status="found")
+
+        self.db.execute(
+            """INSERT OR REPLACE INTO folder_resolutions (folder, mtime, status, deezer_id, name, image_url)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (folder_name, mtime, candidate["status"], candidate["deezer_id"], candidate["detected_name"], candidate["image"])
+        )
+        return candidate, False
+
+    def _run(self):
+        try:
+            folders = self._list_folders()
+            if folders is None:
+                with self.lock:
+                    self.error = "Diretório /music não encontrado"
+                return
+            cache = {r['folder']: r for r in self.db.query("SELECT * FROM folder_resolutions")}
+            with self.lock:
+                self.total = len(folders)
+            sys_logger.log("SCAN", f"🔍 Scan iniciado: {len(folders)} pastas em /music.")
+
+            def work(item):
+                candidate, from_cache = self._resolve(item[0], item[1], cache)
+                with self.lock:
+                    self.results.append(candidate)
+                    if from_cache:
+                        self.cached += 1
+
+            with ThreadPoolExecutor(max_workers=self.SCAN_CONCURRENCY, thread_name_prefix="scan") as ex:
+                # list() propaga exceções inesperadas dos workers
+                list(ex.map(work, folders))
+
+            # Pastas que sumiram não precisam continuar no cache
+            gone = set(cache) - {name for name, _ in folders}
+            if gone:
+                self.db.executemany("DELETE FROM folder_resolutions WHERE folder=?", [(f,) for f in gone])
 
-        return candidates
\ No newline at end of file
+            sys_logger.log("SCAN", f"✅ Scan concluído: {self.total} pastas ({self.cached} do cache).")
+        except Exception as e:
+            sys_logger.log("ERROR", f"Falha no scan da biblioteca: {e}")
+            with self.lock:
+                self.error = str(e)
+        finally:
+            with self.lock:
+                self.running = False
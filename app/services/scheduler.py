@@ -1,93 +1,168 @@
 import threading
 import time
 import datetime
-import os
+import zlib
 from .logger import sys_logger
+from .deezer_http import DeezerAPIError
 from .spider import SpiderService 
 from .maintenance import LibraryMaintenance
-
-MUSIC_LIB_DIR = "/music"
+from .track_linker import TrackLinker
 
 class DailyScheduler(threading.Thread):
-    def __init__(self, db, metadata_provider, downloader):
+    """
+    Varredura de lançamentos em fatias: os artistas são divididos por hash do
+    deezer_id e uma fatia é processada por intervalo (ciclo de 24h), em vez de
+    uma rajada única na madrugada. Jobs diários (manutenção, spider) rodam no
+    primeiro tick a partir do horário. O progresso fica em scheduler_state, então
+    um reinício retoma de onde parou e recupera o que foi perdido.
+    """
+    TICK = 30
+    SCAN_CYCLE = 24 * 3600
+    SCAN_SLICES = 48              # uma fatia a cada 30 min
+    MAINTENANCE_TIME = "04:00"
+
+    def __init__(self, db, metadata_provider, downloader, library):
         super().__init__()
         self.db = db
         self.metadata = metadata_provider
         self.downloader = downloader
+        self.library = library
+        self.linker = TrackLinker(db, library)
         self.daemon = True
-        self.last_scan_run = None
-        self.last_spider_run = None
-        self.last_maint_run = None
-
-    def check_new_releases(self):
-        sys_logger.log("SCHEDULER", "⏰ Varredura de lançamentos iniciada...")
-        
-        artists = self.db.query("SELECT * FROM artists")
+        self._catching_up = False
+
+    @staticmethod
+    def slice_of(deezer_id, slices):
+        # crc32 e não hash(): precisa ser estável entre reinícios
+        return zlib.crc32(str(deezer_id).encode()) % slices
+
+    def check_new_releases(self, full=False, artists=None, label=""):
+        """
+        Por padrão incremental: cada artista só tem avaliados os álbuns que
+        ainda não estão na sua marca d'água (artist_albums_seen), e a paginação
+        para ao chegar em território conhecido. full=True reavalia tudo.
+        """
+        if artists is None:
+            sys_logger.log("SCHEDULER", f"⏰ Varredura de lançamentos iniciada{' (completa)' if full else ''}...")
+            artists = self.db.query("SELECT deezer_id, name FROM artists")
+
+        album_filter = self.db.settings.album_filter
+        # O que já existe em /music vem do índice (incremental), não de um listdir por álbum
+        self.library.ensure_fresh()
 
-        keywords_str = self.db.get_setting('ignored_keywords') or "playback,karaoke,instrumental,backing track"
-        BLACKLIST = [k.strip() for k in keywords_str.split(',')]
-        max_tracks_val = int(self.db.get_setting('max_tracks') or 40)
-        # -----------------------------
-        
         count_new = 0
         count_synced = 0
         
         for art in artists:
+            seen = set() if full else self.db.seen_album_ids(art['deezer_id'])
+            recheck = set() if full else self.db.recheck_album_ids(art['deezer_id'])
+            before = set(seen)
+            failed = set()   # sem tracklist: não marca como visto, tenta de novo na próxima
+            rejected = {}
             try:
-                discography = self.metadata.get_discography(art['deezer_id'], target_artist_id=art['name'])
-                
-                for item in discography:
-                    title_lower = item['title'].lower()
-
-                    if any(bad in title_lower for bad in BLACKLIST): continue
-                    if item.get('nb_tracks', 0) > max_tracks_val: continue
+                for page in self.metadata.iter_discography(art['deezer_id'], target_artist_id=art['name'], album_filter=album_filter,
+                                                           seen=seen, rejected=rejected, recheck=recheck):
+                    known = self.db.existing_album_ids(item['deezer_id'] for item in page)
+                    new_items = [item for item in page if item['deezer_id'] not in known]
+                    tracklists = self.metadata.get_albums_tracks([item['deezer_id'] for item in new_items], fallback_artist=art['name'])
+
+                    for item in new_items:
+                        tracks = tracklists.get(item['deezer_id'])
+                        if tracks is None:
+                            failed.add(item['deezer_id'])
+                            continue
 
-                    exists = self.db.query("SELECT id FROM queue WHERE deezer_id=?", (item['deezer_id'],), one=True)
-                    
-                    if not exists:
                         safe_artist = self.downloader.sanitize(art['name'])
                         safe_album = self.downloader.sanitize(item['title'])
-                        album_path = os.path.join(MUSIC_LIB_DIR, safe_artist, safe_album)
-                        
+                        local = self.library.album(safe_artist, safe_album)
+
                         initial_status = 'pending'
                         log_prefix = "✨ Novo"
-                        
-                        if os.path.exists(album_path):
-                            local_files = [f for f in os.listdir(album_path) if f.endswith(('.mp3', '.flac', '.m4a', '.wav'))]
-                            local_count = len(local_files)
-                            api_total = item.get('nb_tracks', 0)
-                            
+                        # Arquivos com tags: liga faixa a faixa depois de inserir; sem tags, conta arquivos
+                        by_tags = bool(local) and self.linker.has_tags(safe_artist, safe_album)
+
+                        if local and not by_tags:
+                            local_count = local['track_count']
+                            api_total = item.get('track_count', 0)
+
                             if api_total > 0 and local_count >= api_total:
                                 initial_status = 'completed'
                                 log_prefix = "📚 Sincronizado"
-                                count_synced += 1
                             else:
                                 initial_status = 'pending'
                                 log_prefix = f"⚠️ Incompleto ({local_count}/{api_total})"
-                                count_new += 1
+
+                        qid = self.db.add_album(item, art['name'], tracks, status=initial_status)
+                        if not qid:
+                            continue
+
+                        if by_tags:
+                            # link_folder grava o status do álbum; aqui só espelhamos o resultado
+                            done, total = self.linker.link_folder(qid, safe_artist, safe_album)
+                            if total and done == total:
+                                initial_status = 'completed'
+                                log_prefix = "📚 Sincronizado"
+                            else:
+                                initial_status = 'pending'
+                                log_prefix = f"⚠️ Incompleto ({done}/{total})"
+
+                        if initial_status == 'completed':
+                            count_synced += 1
                         else:
                             count_new += 1
-
                         sys_logger.log("NEW", f"{log_prefix}: {item['title']} - {art['name']}")
-                        
-                        cur = self.db.execute(
-                            "INSERT INTO queue (deezer_id, title, artist, type, status, cover_url) VALUES (?, ?, ?, ?, ?, ?)",
-                            (item['deezer_id'], item['title'], art['name'], 'album', initial_status, item['cover'])
-                        )
-                        queue_id = cur.lastrowid
-                        
-                        tracks = self.metadata.get_album_tracks(item['deezer_id'], fallback_artist=art['name'])
-                        for t in tracks:
-                            self.db.execute(
-                                "INSERT INTO tracks (queue_id, title, artist, track_number, status) VALUES (?, ?, ?, ?, ?)", 
-                                (queue_id, t['title'], t['artist'], t['track_num'], initial_status)
-                            )
-
-                time.sleep(1.0)
+
+                # Discografia percorrida até o fim: os que não reapareceram saíram do Deezer
+                self.db.forget_albums_seen(art['deezer_id'], recheck)
+            except DeezerAPIError:
+                pass  # páginas já processadas continuam valendo
             except Exception:
-                pass
+                continue
+
+            self.db.mark_albums_seen(art['deezer_id'], seen - before - failed, rejected)
                 
-        sys_logger.log("SCHEDULER", f"✅ Varredura finalizada. {count_new} enviados para download, {count_synced} já existiam.")
+        if count_new or count_synced or not label:
+            sys_logger.log("SCHEDULER", f"✅ Varredura{label} finalizada. {count_new} enviados para download, {count_synced} já existiam.")
+
+    def scan_release_slice(self, index):
+        artists = [a for a in self.db.query("SELECT deezer_id, name FROM artists")
+                   if self.slice_of(a['deezer_id'], self.SCAN_SLICES) == index]
+        if artists:
+            self.check_new_releases(artists=artists, label=f" (fatia {index + 1}/{self.SCAN_SLICES}, {len(artists)} artistas)")
+
+    def _run_release_slot(self):
+        """Processa no máximo uma fatia por tick; atrasado, vai recuperando uma a uma."""
+        slot_len = self.SCAN_CYCLE / self.SCAN_SLICES
+        current = int(time.time() // slot_len)
+        last = self.db.get_job_state('release_scan')
+        last = int(last) if last is not None else current - 1
+        if last >= current:
+            return
+
+        # Parado por mais de um ciclo: cada fatia só uma vez
+        slot = max(last + 1, current - self.SCAN_SLICES + 1)
+        behind = current - slot
+        if behind and not self._catching_up:
+            sys_logger.log("SCHEDULER", f"⏩ Recuperando varredura atrasada ({behind} fatias pendentes)...")
+        self._catching_up = behind > 0
+        self.scan_release_slice(slot % self.SCAN_SLICES)
+        self.db.set_job_state('release_scan', slot)
+
+    def _seed_daily(self, job, hhmm, now):
+        """
+        Instalação nova (sem histórico do job): se o app subiu depois de hh:mm,
+        hoje conta como feito; se subiu antes, o job roda hoje no horário.
+        """
+        if self.db.get_job_state(job) is None and now.strftime("%H:%M") >= hhmm:
+            self.db.set_job_state(job, now.strftime("%Y-%m-%d"))
+
+    def _daily_due(self, job, hhmm, now):
+        """True uma vez por dia, no primeiro tick a partir de hh:mm (inclusive se o horário passou com o app parado)."""
+        today = now.strftime("%Y-%m-%d")
+        if now.strftime("%H:%M") < hhmm or self.db.get_job_state(job) == today:
+            return False
+        self.db.set_job_state(job, today)
+        return True
 
     def run_spider(self):
         try:
@@ -104,32 +179,31 @@ class DailyScheduler(threading.Thread):
             sys_logger.log("ERROR", f"Falha na Manutenção: {e}")
 
     def run(self):
-        sys_logger.log("SCHEDULER", "🕒 Serviço de Agendamento Iniciado.")
-        
+        sys_logger.log("SCHEDULER", f"🕒 Serviço de Agendamento Iniciado ({self.SCAN_SLICES} fatias de varredura por dia).")
+        try:
+            now = datetime.datetime.now()
+            self._seed_daily('maintenance', self.MAINTENANCE_TIME, now)
+            self._seed_daily('spider', self.db.settings.get('spider_schedule_time'), now)
+        except Exception as e:
+            sys_logger.log("ERROR", f"Erro no Scheduler: {e}")
+
         while True:
             try:
                 now = datetime.datetime.now()
-                current_hm = now.strftime("%H:%M")
-                today = now.strftime("%Y-%m-%d")
 
-                scan_time = self.db.get_setting('scan_time') or '03:00'
-                if current_hm == scan_time and self.last_scan_run != today:
-                    self.check_new_releases()
-                    self.last_scan_run = today
+                self._run_release_slot()
 
-                if current_hm == "04:00" and self.last_maint_run != today:
+                if self._daily_due('maintenance', self.MAINTENANCE_TIME, now):
                     self.run_maintenance()
-                    self.last_maint_run = today
 
-                spider_time = self.db.get_setting('spider_schedule_time') or '12:00'
-                if current_hm == spider_time and self.last_spider_run != today:
-                    if self.db.get_setting('spider_enabled') == 'true':
+                spider_time = self.db.settings.get('spider_schedule_time')
+                if self._daily_due('spider', spider_time, now):
+                    if self.db.settings.get('spider_enabled'):
                         sys_logger.log("SCHEDULER", f"🤖 Hora do Spider ({spider_time})...")
                         threading.Thread(target=self.run_spider).start()
-                    self.last_spider_run = today
 
-                time.sleep(30)
+                time.sleep(self.TICK)
 
             except Exception as e:
                 sys_logger.log("ERROR", f"Erro no Scheduler: {e}")
-                time.sleep(30)
\ No newline at end of file
+                time.sleep(self.TICK)
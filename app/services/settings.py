@@ -0,0 +1,128 @@
+import threading
+from .logger import sys_logger
+from .filters import AlbumFilter
+
+
+def parse_keywords(value):
+    return tuple(k.strip().lower() for k in (value or "").split(',') if k.strip())
+
+
+def parse_bool(value):
+    return str(value).strip().lower() == 'true'
+
+
+class SettingsService:
+    """
+    Cache em memória da tabela settings, com valores já convertidos (int, bool, lista).
+    Escritas passam direto para o banco (write-through) e avisam os assinantes,
+    para que objetos derivados (blacklist, settings do deemix) só sejam
+    reconstruídos quando algo realmente mudar.
+    """
+    # chave -> (conversor, padrão). Valor vazio/ausente usa o padrão.
+    SCHEMA = {
+        'deezer_arl': (str, ''),
+        'download_quality': (int, 3),
+        'download_workers': (int, 1),
+        'download_mode': (str, 'album'),
+        'ignored_keywords': (parse_keywords, ''),
+        'library_watch': (parse_bool, 'false'),
+        'max_tracks': (int, 40),
+        'spider_enabled': (parse_bool, 'false'),
+        'spider_growth_percent': (float, 20.0),
+        'spider_min_fans': (int, 5000),
+        'spider_schedule_time': (str, '12:00'),
+    }
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.RLock()
+        self._raw = None          # chave -> texto do banco (carregado na primeira leitura)
+        self._typed = {}
+        self._derived = {}        # nome -> (chaves, builder)
+        self._derived_cache = {}
+        self._subscribers = []    # (chaves ou None, callback(key, value))
+
+        # Regras de filtro compiladas uma vez; refeitas só quando palavras/limite mudam
+        self.register('album_filter', ['ignored_keywords', 'max_tracks'],
+                      lambda s: AlbumFilter(s.get('ignored_keywords'), s.get('max_tracks')))
+
+    def _ensure_loaded(self):
+        if self._raw is None:
+            rows = self.db.query("SELECT key, value FROM settings")
+            self._raw = {r['key']: r['value'] for r in rows}
+
+    def get_raw(self, key):
+        with self.lock:
+            self._ensure_loaded()
+            return self._raw.get(key)
+
+    def get(self, key):
+        """Valor tipado conforme SCHEMA (texto cru para chaves desconhecidas)."""
+        with self.lock:
+            if key in self._typed:
+                return self._typed[key]
+
+            raw = self.get_raw(key)
+            parser, default = self.SCHEMA.get(key, (str, None))
+            if raw is None or str(raw).strip() == '':
+                raw = default
+            try:
+                value = parser(raw) if raw is not None else None
+            except (TypeError, ValueError):
+                sys_logger.log("CONFIG", f"⚠️ Valor inválido para '{key}': {raw!r}. Usando padrão.")
+                value = parser(default)
+
+            self._typed[key] = value
+            return value
+
+    def set(self, key, value):
+        value = "" if value is None else str(value)
+        with self.lock:
+            self._ensure_loaded()
+            if self._raw.get(key) == value:
+                return False
+            self.db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+            self._raw[key] = value
+            self._typed.pop(key, None)
+            for name, (keys, _) in self._derived.items():
+                if key in keys:
+                    self._derived_cache.pop(name, None)
+            subscribers = [cb for keys, cb in self._subscribers if keys is None or key in keys]
+
+        typed = self.get(key)
+        for cb in subscribers:
+            try:
+                cb(key, typed)
+            except Exception as e:
+                sys_logger.log("ERROR", f"Falha ao notificar mudança de '{key}': {e}")
+        return True
+
+    def subscribe(self, callback, keys=None):
+        """callback(key, valor_tipado) a cada mudança real de uma das chaves (ou de qualquer uma)."""
+        with self.lock:
+            self._subscribers.append((set(keys) if keys else None, callback))
+
+    def register(self, name, keys, builder):
+        """Objeto derivado de algumas chaves: builder(self) só roda de novo quando elas mudam."""
+        with self.lock:
+            self._derived[name] = (set(keys), builder)
+            self._derived_cache.pop(name, None)
+
+    def computed(self, name):
+        with self.lock:
+            if name not in self._derived_cache:
+                _, builder = self._derived[name]
+                self._derived_cache[name] = builder(self)
+            return self._derived_cache[name]
+
+    @property
+    def blacklist(self):
+        return self.get('ignored_keywords')
+
+    @property
+    def max_tracks(self):
+        return self.get('max_tracks')
+
+    @property
+    def album_filter(self):
+        return self.computed('album_filter')
@@ -1,116 +1,306 @@
 import math
-import time
-import random
+import threading
 from .logger import sys_logger
+from .deezer_http import DeezerAPIError
 
 class SpiderService:
+    """
+    Crawler do grafo de "relacionados" (Fans also like), persistido no banco:
+    - spider_visited: artistas da biblioteca cujos relacionados já foram buscados;
+    - spider_edges: arestas artista -> relacionado (cache do endpoint);
+    - spider_frontier: candidatos fora da biblioteca, pontuados por fãs e por
+      quantos artistas da biblioteca apontam para eles.
+    Cada execução expande nós ainda não visitados e consome a fronteira pela
+    maior pontuação: o grafo cresce a cada dia em vez de ser reamostrado.
+    """
+    EXPAND_PER_RUN = 20
+    RELATED_LIMIT = 25
+    # Um artista da biblioteca a mais apontando vale o mesmo que 100x mais fãs
+    INBOUND_WEIGHT = 2.0
+    # Relacionados mudam devagar: um nó só é reexpandido depois disso
+    REEXPAND_DAYS = 30
+    MAX_ROUNDS = 3
+    # Rejeição que não é definitiva: o mínimo de fãs pode baixar e os fãs do candidato crescer
+    LOW_FANS = 'poucos fãs'
+
     def __init__(self, db, metadata_provider, downloader):
         self.db = db
         self.metadata = metadata_provider
         self.downloader = downloader
 
-    def run(self):
-        enabled = self.db.get_setting('spider_enabled')
-        if enabled != 'true':
+    def score(self, fans, inbound):
+        return math.log10(max(fans, 0) + 1) + self.INBOUND_WEIGHT * inbound
+
+    # --- GRAFO ---
+
+    def expand(self, limit=None):
+        """Busca os relacionados dos próximos artistas da biblioteca (nunca visitados primeiro)."""
+        rows = self.db.query(f'''
+            SELECT a.deezer_id FROM artists a
+            LEFT JOIN spider_visited v ON v.deezer_id = a.deezer_id
+            WHERE v.deezer_id IS NULL OR v.expanded_at < datetime('now', '-{self.REEXPAND_DAYS} days')
+            ORDER BY v.expanded_at IS NOT NULL, v.expanded_at, a.added_at
+            LIMIT ?''', (limit or self.EXPAND_PER_RUN,))
+
+        candidates = {}
+        expanded = 0
+        for row in rows:
+            source = row['deezer_id']
+            try:
+                related = self.metadata.get_related_by_id(source, limit=self.RELATED_LIMIT)
+            except DeezerAPIError:
+                continue  # fica sem visitar; tenta de novo na próxima execução
+
+            with self.db.transaction():
+                self.db.execute("DELETE FROM spider_edges WHERE source_id=?", (source,))
+                self.db.executemany("INSERT OR IGNORE INTO spider_edges (source_id, target_id) VALUES (?, ?)",
+                                    [(source, c['id']) for c in related])
+                self.db.execute("INSERT OR REPLACE INTO spider_visited (deezer_id, expanded_at) VALUES (?, CURRENT_TIMESTAMP)", (source,))
+            for c in related:
+                candidates[c['id']] = c
+            expanded += 1
+
+        self._update_frontier(candidates)
+        return expanded, len(candidates)
+
+    def _inbound_counts(self, ids):
+        counts = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = self.db.query(f"SELECT target_id, COUNT(*) as c FROM spider_edges WHERE target_id IN ({marks}) GROUP BY target_id", chunk)
+            counts.update((r['target_id'], r['c']) for r in rows)
+        return counts
+
+    def _update_frontier(self, candidates):
+        in_library = self.db.existing_artist_ids(candidates)
+        ids = [cid for cid in candidates if cid not in in_library]
+        if not ids:
             return
+        inbound = self._inbound_counts(ids)
+
+        # Upsert: atualiza fãs/pontuação, mas mantém o status (rejeitado continua rejeitado)
+        self.db.executemany(
+            """INSERT INTO spider_frontier (deezer_id, name, fans, image_url, inbound, score)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(deezer_id) DO UPDATE SET
+                   name = excluded.name, fans = excluded.fans, image_url = excluded.image_url,
+                   inbound = excluded.inbound, score = excluded.score, updated_at = CURRENT_TIMESTAMP""",
+            [
+                (cid, candidates[cid]['name'], candidates[cid]['fans'], candidates[cid]['image'],
+                 inbound.get(cid, 0), self.score(candidates[cid]['fans'], inbound.get(cid, 0)))
+                for cid in ids
+            ]
+        )
+
+    def _mark(self, deezer_id, status, reason=None):
+        self.db.execute("UPDATE spider_frontier SET status=?, reason=?, updated_at=CURRENT_TIMESTAMP WHERE deezer_id=?",
+                        (status, reason, deezer_id))
+
+    # --- AVALIAÇÃO (barato primeiro) ---
+    # 1. já está na biblioteca?  -> uma consulta por lote
+    # 2. fãs >= spider_min_fans  -> dado que já veio do /related
+    # 3. nb_album do /artist/{id} -> uma chamada leve (em cache)
+    # 4. discografia filtrada com pelo menos um álbum novo
+    # Só quem passa em tudo tem tracklists buscadas, imagem baixada e escritas no banco.
+
+    def _iter_frontier(self, batch_size=50):
+        """Fronteira da maior para a menor pontuação, em lotes (cursor estável mesmo com status mudando)."""
+        cursor = (float('inf'), '')
+        while True:
+            batch = self.db.query(
+                """SELECT * FROM spider_frontier WHERE status='queued'
+                   AND (score < ? OR (score = ? AND deezer_id > ?))
+                   ORDER BY score DESC, deezer_id ASC LIMIT ?""",
+                (cursor[0], cursor[0], cursor[1], batch_size))
+            if not batch:
+                return
+            yield batch
+            cursor = (batch[-1]['score'], batch[-1]['deezer_id'])
+
+    def _screen(self, batch, min_fans):
+        """Estágios 1 e 2, em lote. Retorna (sobreviventes, {deezer_id: (status, motivo)})."""
+        known = self.db.existing_artist_ids(c['deezer_id'] for c in batch)
+        survivors, verdicts = [], {}
+        for cand in batch:
+            if cand['deezer_id'] in known:
+                verdicts[cand['deezer_id']] = ('known', None)
+            elif cand['fans'] < min_fans:
+                verdicts[cand['deezer_id']] = ('rejected', self.LOW_FANS)
+            else:
+                survivors.append(cand)
+        return survivors, verdicts
+
+    def _plan(self, cand, album_filter):
+        """Estágios 3 e 4, só leitura: (álbuns novos que entrariam na fila, motivo da rejeição)."""
+        info = self.metadata.get_artist_by_id(cand['deezer_id'])
+        if info is not None and not info.get('albums'):
+            return [], 'sem álbuns no Deezer'
+
+        albums = self.metadata.get_discography(cand['deezer_id'], target_artist_id=cand['name'], album_filter=album_filter)
+        known = self.db.existing_album_ids(a['deezer_id'] for a in albums)
+        new_albums = [a for a in albums if a['deezer_id'] not in known]
+        return new_albums, (None if new_albums else 'sem álbuns válidos')
+
+    def _admit(self, cand, new_albums):
+        """Estágio caro: tracklists, artista + álbuns numa transação, imagem."""
+        c_id, c_name = cand['deezer_id'], cand['name']
+        tracklists = self.metadata.get_albums_tracks([a['deezer_id'] for a in new_albums], fallback_artist=c_name)
+        ready = [(a, tracklists[a['deezer_id']]) for a in new_albums if a['deezer_id'] in tracklists]
+        if not ready:
+            return 0
+
+        alb_count = 0
+        with self.db.transaction():
+            self.db.upsert_artist(c_id, c_name, cand['image_url'], genre='Descoberta Automática')
+            for album, tracks in ready:
+                # AQUI ESTÁ A REGRA: artist=c_name (O artista descoberto).
+                # O Downloader vai garantir que ele seja o Main Artist e feats vão pro título.
+                if self.db.add_album(album, c_name, tracks, status='pending'):
+                    alb_count += 1
+
+        if cand['image_url']:
+            self.downloader.save_artist_image(c_name, cand['image_url'])
+        sys_logger.log("SPIDER", f"✨ Descoberto: {c_name} (+{alb_count} álbuns na fila).")
+        return alb_count
+
+    def _consume(self, wanted, settings, dry_run=False):
+        album_filter = settings.album_filter
+        min_fans = settings.get('spider_min_fans')
+        report = {'artists': [], 'albums': 0, 'tracks': 0, 'rejected': {}}
+
+        for batch in self._iter_frontier():
+            survivors, verdicts = self._screen(batch, min_fans)
+
+            for cand in survivors:
+                if len(report['artists']) >= wanted: break
+                c_id = cand['deezer_id']
+                try:
+                    new_albums, reason = self._plan(cand, album_filter)
+                    if reason:
+                        verdicts[c_id] = ('rejected', reason)
+                    elif dry_run:
+                        report['albums'] += len(new_albums)
+                        report['tracks'] += sum(a.get('track_count', 0) for a in new_albums)
+                        report['artists'].append(cand['name'])
+                    else:
+                        alb_count = self._admit(cand, new_albums)
+                        if alb_count:
+                            verdicts[c_id] = ('added', None)
+                            report['albums'] += alb_count
+                            report['artists'].append(cand['name'])
+                        # Sem nenhuma tracklist: continua na fronteira, tenta na próxima execução
+                except DeezerAPIError:
+                    # API instável: o candidato continua na fronteira para a próxima execução
+                    sys_logger.log("SPIDER", "⚠️ API do Deezer indisponível. Interrompendo.")
+                    wanted = 0
+                    break
+                except Exception as e:
+                    sys_logger.log("SPIDER", f"⚠️ Erro ao processar {cand['name']}: {e}")
+                    verdicts[c_id] = ('rejected', str(e))
+
+            for c_id, (status, reason) in verdicts.items():
+                if status == 'rejected':
+                    report['rejected'][reason] = report['rejected'].get(reason, 0) + 1
+                # Poucos fãs não sai da fronteira: é reavaliado a cada execução, sem custo de API
+                if not dry_run and reason != self.LOW_FANS:
+                    self._mark(c_id, status, reason)
+
+            if len(report['artists']) >= wanted:
+                break
+        return report
+
+    def run(self, dry_run=False):
+        """
+        dry_run=True não grava nada (nem expande o grafo): percorre a fronteira
+        atual e retorna quantos artistas/álbuns/faixas entrariam na fila.
+        """
+        settings = self.db.settings
+        if not dry_run and not settings.get('spider_enabled'):
+            return None
+
+        # Valores já tipados (e com padrão) vindos do cache de configurações
+        growth_percent = settings.get('spider_growth_percent')
+
+        total_artists = self.db.get_counter('artists')
 
-        try:
-            growth_str = self.db.get_setting('spider_growth_percent')
-            growth_percent = float(growth_str) if growth_str else 20.0
-            
-            fans_str = self.db.get_setting('spider_min_fans')
-            min_fans = int(fans_str) if fans_str else 5000
-            
-            # Carrega configurações globais para respeitar as regras do usuário
-            keywords = self.db.get_setting('ignored_keywords') or ""
-            BLACKLIST = [k.strip().lower() for k in keywords.split(',') if k.strip()]
-            MAX_TRACKS = int(self.db.get_setting('max_tracks') or 40)
-            
-        except:
-            growth_percent = 20.0
-            min_fans = 5000
-            BLACKLIST = ["playback", "backing track", "karaoke", "instrumental"]
-            MAX_TRACKS = 40
-
-        res = self.db.query("SELECT count(*) as c FROM artists", one=True)
-        total_artists = res['c']
-        
         if total_artists == 0:
             sys_logger.log("SPIDER", "⚠️ Biblioteca vazia. Adicione um artista manualmente para iniciar a teia.")
-            return
+            return None
 
         target_new = math.ceil(total_artists * (growth_percent / 100.0))
         target_new = max(1, target_new)
-        
+
+        if dry_run:
+            report = self._consume(target_new, settings, dry_run=True)
+            report['target'] = target_new
+            sys_logger.log("SPIDER", f"🔎 Simulação: +{len(report['artists'])}/{target_new} artistas, +{report['albums']} álbuns, ~{report['tracks']} faixas.")
+            return report
+
         sys_logger.log("SPIDER", f"🕸️ Iniciando. Meta: +{target_new} novos ({growth_percent}%)")
 
-        seeds = self.db.query("SELECT deezer_id, name FROM artists ORDER BY RANDOM() LIMIT 20")
-        added_count = 0
-        
-        for seed in seeds:
-            if added_count >= target_new: break
+        added = {'artists': [], 'albums': 0, 'tracks': 0, 'rejected': {}}
+        for _ in range(self.MAX_ROUNDS):
+            expanded, found = self.expand()
+            frontier = self.db.query("SELECT COUNT(*) as c FROM spider_frontier WHERE status='queued'", one=True)['c']
+            sys_logger.log("SPIDER", f"🔗 {expanded} artistas expandidos, {found} relacionados. Fronteira: {frontier} candidatos.")
+
+            report = self._consume(target_new - len(added['artists']), settings)
+            added['artists'] += report['artists']
+            added['albums'] += report['albums']
+            for reason, n in report['rejected'].items():
+                added['rejected'][reason] = added['rejected'].get(reason, 0) + n
+            # Meta batida, ou nada novo para expandir (os recém-adicionados só entram na próxima rodada)
+            if len(added['artists']) >= target_new or expanded == 0:
+                break
+
+        sys_logger.log("SPIDER", f"🏁 Finalizado. +{len(added['artists'])} novos artistas, +{added['albums']} álbuns.")
+        return added
 
-            try:
-                # Usa a lógica de 'Related Artists' (Fans also like)
-                related = self.metadata.get_related_artists(seed['deezer_id'])
-            except:
-                related = []
-            
-            for candidate in related:
-                if added_count >= target_new: break
-
-                c_id = str(candidate['id'])
-                c_name = candidate['name']
-                c_fans = candidate.get('nb_fan', 0)
-                c_img = candidate.get('picture_xl', candidate.get('picture_medium', ''))
-
-                # Validações
-                exists = self.db.query("SELECT 1 FROM artists WHERE deezer_id=?", (c_id,), one=True)
-                if exists: continue
-                
-                # Se não tem fãs suficientes na plataforma, ignora (evita artistas errados/covers ruins)
-                # O parâmetro vem do get_related_artists simulado, pode não ter nb_fan preciso, mas tentamos
-                # Se nb_fan vier 0 no related, ignoramos a checagem pra não travar
-                
-                try:
-                    self.db.execute("INSERT INTO artists (deezer_id, name, genre) VALUES (?, ?, ?)", 
-                                   (c_id, c_name, 'Descoberta Automática'))
-
-                    if c_img:
-                        self.downloader.save_artist_image(c_name, c_img)
-
-                    sys_logger.log("SPIDER", f"✨ Descoberto: {c_name}. Buscando álbuns...")
-
-                    albums = self.metadata.get_discography(c_id, target_artist_id=c_name)
-                    alb_count = 0
-                    
-                    for album in albums:
-                        # 1. Checa Blacklist Global
-                        if any(bad in album['title'].lower() for bad in BLACKLIST): continue
-                        
-                        # 2. Checa Limite de Faixas Global
-                        if album.get('track_count', 0) > MAX_TRACKS: continue
-                        
-                        exists_alb = self.db.query("SELECT 1 FROM queue WHERE deezer_id=?", (album['deezer_id'],), one=True)
-                        if not exists_alb:
-                            # AQUI ESTÁ A REGRA: artist=c_name (O artista descoberto).
-                            # O Downloader vai garantir que ele seja o Main Artist e feats vão pro título.
-                            self.db.execute("""
-                                INSERT INTO queue (deezer_id, title, artist, type, status, cover_url)
-                                VALUES (?, ?, ?, 'album', 'pending', ?)
-                            """, (album['deezer_id'], album['title'], c_name, album['cover']))
-                            alb_count += 1
-                    
-                    if alb_count > 0:
-                        sys_logger.log("SPIDER", f"   ↳ +{alb_count} álbuns na fila.")
-                        added_count += 1
-                    else:
-                        # Se não achou álbuns válidos (filtros), remove o artista pra não poluir
-                        self.db.execute("DELETE FROM artists WHERE deezer_id=?", (c_id,))
-                    
-                except Exception as e:
-                    sys_logger.log("SPIDER", f"⚠️ Erro ao processar {c_name}: {e}")
 
-                time.sleep(0.5)
+class SpiderPreview:
+    """
+    Simulação do Spider (run(dry_run=True)) em background: pode consultar
+    centenas de /related e discografias no ritmo do rate limit, então não
+    cabe numa requisição HTTP. A página de Ajustes inicia e acompanha via status().
+    """
 
-        sys_logger.log("SPIDER", f"🏁 Finalizado. +{added_count} novos artistas.")
\ No newline at end of file
+    def __init__(self, db, metadata_provider, downloader):
+        self.spider = SpiderService(db, metadata_provider, downloader)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.error = None
+        self.report = None
+
+    def start(self):
+        """Inicia uma simulação se nenhuma estiver rodando. Retorna False se já havia uma."""
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.error = None
+            self.report = None
+        self.thread = threading.Thread(target=self._run, name="SpiderPreview", daemon=True)
+        self.thread.start()
+        return True
+
+    def status(self):
+        with self.lock:
+            return {"running": self.running, "error": self.error, "report": self.report}
+
+    def _run(self):
+        try:
+            report = self.spider.run(dry_run=True)
+            with self.lock:
+                self.report = report or {'artists': [], 'albums': 0, 'tracks': 0, 'rejected': {}, 'target': 0}
+        except DeezerAPIError:
+            with self.lock:
+                self.error = "API do Deezer indisponível."
+        except Exception as e:
+            sys_logger.log("SPIDER", f"❌ Erro na simulação: {e}")
+            with self.lock:
+                self.error = str(e)
+        finally:
+            with self.lock:
+                self.running = False
@@ -0,0 +1,246 @@
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from .artist_index import normalize
+from .album_matcher import AlbumMatcher
+
+# Chaves onde cada formato guarda o ID do Deezer (deemix grava SOURCEID com a tag "source")
+DEEZER_ID_KEYS = ('sourceid', 'deezer_track_id', 'deezer_id')
+
+
+def _text(value):
+    """Primeiro valor de uma tag do mutagen como texto (lista, frame ID3, freeform MP4, tupla)."""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if hasattr(value, 'text'):
+        value = value.text[0] if value.text else None
+    if isinstance(value, tuple):
+        value = value[0]
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    value = str(value).strip() if value is not None else ''
+    return value or None
+
+
+def read_tags(path):
+    """
+    Lê as tags de um arquivo. Retorna um dict com title/album/track_number/
+    duration/isrc/deezer_id, ou None se o mutagen não reconhecer o arquivo.
+    """
+    from mutagen import File as MutagenFile
+    try:
+        audio = MutagenFile(path)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+
+    tags = {}
+    for key, value in (audio.tags.items() if audio.tags else ()):
+        key = key.lower()
+        # ID3: "TXXX:SOURCEID" / MP4: "----:com.apple.iTunes:ISRC" -> nome depois do último ':'
+        if key.startswith(('txxx:', '----:')):
+            key = key.rsplit(':', 1)[1]
+        tags.setdefault(key, value)
+
+    def first(*keys):
+        for key in keys:
+            value = _text(tags.get(key))
+            if value:
+                return value
+        return None
+
+    number = first('tracknumber', 'trck', 'trkn')
+    number = re.match(r"\d+", number) if number else None
+    length = getattr(audio.info, 'length', None)
+    return {
+        'title': first('title', 'tit2', '\xa9nam'),
+        'album': first('album', 'talb', '\xa9alb'),
+        'track_number': int(number.group(0)) if number else None,
+        'duration': int(round(length)) if length else None,
+        'isrc': (first('isrc', 'tsrc') or '').upper() or None,
+        'deezer_id': first(*DEEZER_ID_KEYS),
+    }
+
+
+class TrackLinker:
+    """
+    Liga as faixas da fila (tracks) aos arquivos de /music pelas tags:
+    primeiro por identificador forte (ID do Deezer, ISRC), depois por título
+    parecido com duração próxima (ou mesmo número de faixa), um-para-um.
+    As tags ficam em file_tags, válidas enquanto mtime e tamanho do arquivo
+    não mudarem: reimportar só lê arquivos novos ou alterados. Lotes grandes
+    são lidos num pool de threads: a leitura só toca o cabeçalho de cada
+    arquivo, e o tempo vai em abrir/ler (storage de rede), não em CPU.
+    """
+    POOL_SIZE = 4
+    # Abaixo disso não compensa usar o pool
+    INLINE_LIMIT = 16
+    TITLE_THRESHOLD = 0.8
+    DURATION_TOLERANCE = 3
+
+    def __init__(self, db, library):
+        self.db = db
+        self.library = library
+        self._pool = None
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+
+    # --- TAGS ---
+
+    def _read_many(self, paths):
+        if len(paths) < self.INLINE_LIMIT:
+            return list(map(read_tags, paths))
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.POOL_SIZE, thread_name_prefix="tags")
+        return list(self._pool.map(read_tags, paths))
+
+    def _scan_folder(self, folder):
+        stats = {}
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.lower().endswith(self.library.AUDIO_EXTENSIONS) and entry.is_file():
+                        st = entry.stat()
+                        stats[entry.path] = (st.st_mtime, st.st_size)
+        except FileNotFoundError:
+            pass
+        return stats
+
+    def tags_for(self, folders):
+        """
+        {(artista, álbum): {caminho: tags}} para várias pastas de álbum. Só os
+        arquivos novos ou alterados (mtime/tamanho) são lidos, todos num lote só.
+        """
+        stats, cached = {}, {}
+        for key in folders:
+            folder = os.path.join(self.library.root, *key)
+            stats[key] = self._scan_folder(folder)
+            # Faixa de chaves da pasta no PK
+            prefix = folder + os.sep
+            cached[key] = {r['path']: r for r in self.db.query(
+                "SELECT * FROM file_tags WHERE path >= ? AND path < ?", (prefix, prefix + '\uffff'))}
+
+        stale = [(p, st) for key in folders for p, st in stats[key].items()
+                 if p not in cached[key] or (cached[key][p]['mtime'], cached[key][p]['size']) != st]
+        fresh = dict(zip([p for p, _ in stale], self._read_many([p for p, _ in stale]))) if stale else {}
+        gone = [p for key in folders for p in cached[key] if p not in stats[key]]
+        if fresh or gone:
+            with self.db.transaction():
+                self.db.executemany(
+                    """INSERT OR REPLACE INTO file_tags
+                       (path, mtime, size, title, album, track_number, duration, isrc, deezer_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    [(p, *st, *((fresh[p] or {}).get(k) for k in ('title', 'album', 'track_number', 'duration', 'isrc', 'deezer_id')))
+                     for p, st in stale])
+                self.db.executemany("DELETE FROM file_tags WHERE path=?", [(p,) for p in gone])
+
+        result = {}
+        for key in folders:
+            result[key] = {p: dict(fresh[p] or {}) if p in fresh else dict(cached[key][p]) for p in stats[key]}
+        return result
+
+    def folder_tags(self, artist_folder, album_folder):
+        """{caminho: tags} dos arquivos de áudio de uma pasta de álbum."""
+        return self.tags_for([(artist_folder, album_folder)])[(artist_folder, album_folder)]
+
+    def has_tags(self, artist_folder, album_folder):
+        """Algum arquivo da pasta tem tags legíveis (título)?"""
+        return any(t.get('title') for t in self.folder_tags(artist_folder, album_folder).values())
+
+    def album_label(self, tags):
+        """Nome de álbum mais comum nas tags de uma pasta (None se nenhuma tiver)."""
+        albums = Counter(t.get('album') for t in tags.values() if t.get('album'))
+        return albums.most_common(1)[0][0] if albums else None
+
+    def match_renamed(self, artist_folder, folders, titles, links):
+        """
+        Completa `links` ({posição do título: índice da pasta}, vindo do
+        AlbumMatcher pelos nomes) casando as pastas que sobraram pelo nome do
+        álbum gravado nas tags: acha álbuns em pastas renomeadas.
+        """
+        taken = set(links.values())
+        rest = [i for i in range(len(folders)) if i not in taken]
+        open_pos = [p for p in range(len(titles)) if p not in links]
+        if not rest or not open_pos:
+            return links
+
+        tags = self.tags_for([(artist_folder, folders[i]) for i in rest])
+        labeled = [(i, self.album_label(tags[(artist_folder, folders[i])])) for i in rest]
+        labeled = [(i, label) for i, label in labeled if label]
+        if labeled:
+            by_tag = AlbumMatcher([label for _, label in labeled]).match_indices([titles[p] for p in open_pos])
+            for k, j in by_tag.items():
+                links[open_pos[k]] = labeled[j][0]
+        return links
+
+    # --- LIGAÇÃO ---
+
+    def _pairs(self, tracks, files):
+        """Pares (faixa, arquivo) um-para-um: IDs fortes primeiro, depois título/duração."""
+        pairs, used_tracks, used_files = {}, set(), set()
+
+        for key in ('deezer_id', 'isrc'):
+            by_value = {}
+            for path, t in files.items():
+                if t.get(key) and path not in used_files:
+                    by_value.setdefault(str(t[key]).upper(), path)
+            for tr in tracks:
+                value = tr[key] and str(tr[key]).upper()
+                path = by_value.get(value) if value else None
+                if path and tr['id'] not in used_tracks and path not in used_files:
+                    pairs[tr['id']] = path
+                    used_tracks.add(tr['id'])
+                    used_files.add(path)
+
+        scored = []
+        sm = SequenceMatcher(None)
+        for tr in tracks:
+            if tr['id'] in used_tracks:
+                continue
+            sm.set_seq2(normalize(tr['title']))
+            for path, t in files.items():
+                if path in used_files or not t.get('title'):
+                    continue
+                sm.set_seq1(normalize(t['title']))
+                ratio = sm.ratio()
+                close = bool(t.get('duration') and tr['duration']) and abs(t['duration'] - tr['duration']) <= self.DURATION_TOLERANCE
+                same_number = bool(tr['track_number']) and t.get('track_number') == tr['track_number']
+                unknown_duration = not (t.get('duration') and tr['duration'])
+                if (ratio >= self.TITLE_THRESHOLD and (close or unknown_duration)) or (same_number and close and ratio >= 0.5):
+                    scored.append((ratio + 0.2 * close + 0.2 * same_number, tr['id'], path))
+
+        scored.sort(key=lambda s: -s[0])
+        for _, track_id, path in scored:
+            if track_id in used_tracks or path in used_files:
+                continue
+            pairs[track_id] = path
+            used_tracks.add(track_id)
+            used_files.add(path)
+        return pairs
+
+    def link_folder(self, queue_id, artist_folder, album_folder):
+        """
+        Liga as faixas do álbum aos arquivos da pasta e marca as ligadas como
+        'completed'; o álbum fica 'completed' se todas ligarem, senão 'pending'.
+        Retorna (ligadas, total), ou (0, 0) se nenhum arquivo da pasta tiver tags legíveis.
+        """
+        files = {p: t for p, t in self.folder_tags(artist_folder, album_folder).items() if t.get('title')}
+        if not files:
+            return 0, 0
+
+        tracks = self.db.query("SELECT * FROM tracks WHERE queue_id=?", (queue_id,))
+        pairs = self._pairs(tracks, files)
+        complete = bool(tracks) and len(pairs) == len(tracks)
+        with self.db.transaction():
+            self.db.executemany("UPDATE tracks SET status='completed', file_path=? WHERE id=?",
+                                [(path, track_id) for track_id, path in pairs.items()])
+            self.db.execute("UPDATE queue SET status=? WHERE id=?", ('completed' if complete else 'pending', queue_id))
+        return len(pairs), len(tracks)
@@ -0,0 +1,104 @@
+"""
+Benchmark do AlbumMatcher (user-022) contra o laço antigo de SequenceMatcher.
+
+Biblioteca sintética: títulos aleatórios do Deezer e pastas locais com
+prefixo de ano, sufixo [FLAC], maiúsculas/underscores, erros de digitação
+de uma letra e pastas sem relação. Uso, a partir da raiz do repositório:
+
+    python bench/bench_album_matcher.py [--artists 500] [--albums 25] [--big 12000]
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.services.album_matcher import AlbumMatcher  # noqa: E402
+
+
+def make_library(rnd, n_artists, n_albums):
+    words = [''.join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 9))) for _ in range(3000)]
+    words += ['the', 'love', 'live', 'of', 'in', 'me', 'you', 'night']
+
+    def title():
+        return ' '.join(rnd.choice(words) for _ in range(rnd.randint(1, 4))).title()
+
+    def variant(t):
+        r = rnd.random()
+        if r < .3:
+            return f"{rnd.randint(1970, 2024)} - {t}"
+        if r < .5:
+            return f"{t} [FLAC]"
+        if r < .65:
+            return t.upper().replace(' ', '_')
+        if r < .8 and len(t) > 6:
+            i = rnd.randrange(len(t))
+            return t[:i] + rnd.choice(string.ascii_lowercase) + t[i + 1:]
+        return t + "!"
+
+    library = []
+    for _ in range(n_artists):
+        remote = [title() for _ in range(n_albums)]
+        local = [variant(t) for t in remote if rnd.random() < .7] + [title() for _ in range(n_albums // 5)]
+        rnd.shuffle(local)
+        library.append((remote, local))
+    return library
+
+
+def old_match(remote, local):
+    """O laço de background_import_existing antes do AlbumMatcher."""
+    result = {}
+    for pos, title in enumerate(remote):
+        clean_dz = re.sub(r'[^\w\s]', '', title).lower()
+        for loc in local:
+            clean_loc = re.sub(r'[^\w\s]', '', loc).lower()
+            if SequenceMatcher(None, clean_dz, clean_loc).ratio() > 0.75 or clean_dz in clean_loc:
+                result[pos] = loc
+                break
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--artists', type=int, default=500)
+    parser.add_argument('--albums', type=int, default=25)
+    parser.add_argument('--big', type=int, default=12000, help="álbuns do artista gigante (0 pula)")
+    opts = parser.parse_args()
+    rnd = random.Random(7)
+
+    library = make_library(rnd, opts.artists, opts.albums)
+    started = time.perf_counter()
+    old = [old_match(remote, local) for remote, local in library]
+    t_old = time.perf_counter() - started
+    started = time.perf_counter()
+    new = [AlbumMatcher(local).match(remote) for remote, local in library]
+    t_new = time.perf_counter() - started
+
+    same = sum(1 for o, n in zip(old, new) for pos in o if n.get(pos) == o[pos])
+    double = sum(len(o) - len(set(o.values())) for o in old)
+    print(f"{opts.artists} artistas x {opts.albums} álbuns, {sum(len(l) for _, l in library)} pastas")
+    print(f"  antigo {t_old:6.2f}s  {sum(map(len, old))} ligações ({double} pastas usadas duas vezes)")
+    print(f"  novo   {t_new:6.2f}s  {sum(map(len, new))} ligações ({same} iguais às do antigo)")
+
+    if opts.big:
+        (remote, local), = make_library(rnd, 1, opts.big)
+        started = time.perf_counter()
+        matched = AlbumMatcher(local).match(remote)
+        t_new = time.perf_counter() - started
+        # O antigo é quadrático: mede uma amostra e extrapola
+        sample = remote[:50]
+        started = time.perf_counter()
+        old_match(sample, local)
+        t_old = (time.perf_counter() - started) / len(sample) * len(remote)
+        print(f"1 artista, {len(remote)} álbuns x {len(local)} pastas")
+        print(f"  antigo ~{t_old:6.0f}s (estimado por {len(sample)} álbuns)")
+        print(f"  novo   {t_new:7.2f}s  {len(matched)} ligações")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark das conexões do Database (user-001).
+
+Compara o padrão antigo (um sqlite3.connect por comando, journal padrão)
+com as conexões persistentes por thread em WAL, numa biblioteca sintética
+de 10k álbuns / 100k faixas. Uso, a partir da raiz do repositório:
+
+    python bench/bench_connections.py [--albums 10000] [--ops 5000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.database import Database  # noqa: E402
+
+
+class OldDatabase:
+    """Como o Database era antes: uma conexão nova para cada comando."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def get_connection(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def query(self, sql, args=(), one=False):
+        conn = self.get_connection()
+        try:
+            rv = conn.execute(sql, args).fetchall()
+            return (rv[0] if rv else None) if one else rv
+        finally:
+            conn.close()
+
+    def execute(self, sql, args=()):
+        conn = self.get_connection()
+        try:
+            cur = conn.execute(sql, args)
+            conn.commit()
+            return cur
+        finally:
+            conn.close()
+
+
+def populate(db, albums, tracks_per_album=10):
+    with db.transaction():
+        for a in range(albums):
+            qid = db.execute("INSERT INTO queue (deezer_id, title, artist, type, status) VALUES (?, ?, ?, 'album', 'pending')",
+                             (str(a), f"Album {a}", f"Artist {a % 1000}")).lastrowid
+            db.executemany("INSERT INTO tracks (queue_id, deezer_id, title, artist, track_number) VALUES (?, ?, ?, ?, ?)",
+                           [(qid, f"{a}-{n}", f"Track {n}", f"Artist {a % 1000}", n) for n in range(1, tracks_per_album + 1)])
+
+
+def run(db, albums, ops):
+    rnd = random.Random(42)
+    started = time.perf_counter()
+    for _ in range(ops):
+        db.query("SELECT * FROM tracks WHERE queue_id=? AND status='pending'", (rnd.randint(1, albums),))
+    reads = ops / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(ops):
+        db.execute("UPDATE tracks SET status='completed' WHERE id=?", (rnd.randint(1, albums * 10),))
+    writes = ops / (time.perf_counter() - started)
+    return reads, writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--albums', type=int, default=10000)
+    parser.add_argument('--ops', type=int, default=5000)
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label in ('antes', 'depois'):
+            path = os.path.join(tmp, label, 'melodock.db')
+            db = Database(path)
+            db.init_db()
+            populate(db, opts.albums)
+            if label == 'antes':
+                # Banco antigo: sem WAL
+                db.get_connection().execute("PRAGMA journal_mode=DELETE")
+                db.close()
+                db = OldDatabase(path)
+            results[label] = run(db, opts.albums, opts.ops)
+
+    print(f"{opts.albums} álbuns, {opts.albums * 10} faixas, {opts.ops} operações de cada tipo")
+    for label, (reads, writes) in results.items():
+        print(f"  {label:7} {reads:10.0f} leituras/s  {writes:10.0f} escritas/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+from app.services.album_matcher import AlbumMatcher
+
+
+def test_near_identical_titles_do_not_share_a_folder():
+    # "Greatest Hits" está contido no nome da pasta, mas a pasta é do "II"
+    matcher = AlbumMatcher(["2001 - Greatest Hits II"])
+    assert matcher.match(["Greatest Hits", "Greatest Hits II"]) == {1: "2001 - Greatest Hits II"}
+
+
+def test_each_title_gets_its_own_folder():
+    folders = ["Greatest Hits II [FLAC]", "Greatest Hits [FLAC]", "Unrelated"]
+    matcher = AlbumMatcher(folders)
+    assert matcher.match(["Greatest Hits", "Greatest Hits II"]) == {
+        0: "Greatest Hits [FLAC]",
+        1: "Greatest Hits II [FLAC]",
+    }
+
+
+def test_duplicate_folder_names_are_assigned_once():
+    matcher = AlbumMatcher(["Live", "Live"])
+    assert matcher.match_indices(["Live", "Live!", "Live"]) == {0: 0, 1: 1}
+
+
+def test_unrelated_titles_are_not_matched():
+    assert AlbumMatcher(["Night Songs", "Blue"]).match(["Something Else"]) == {}
@@ -0,0 +1,94 @@
+from app.database import Database
+from app.services.deezer_data import DeezerDataClient
+from app.services.deezer_http import DeezerAPIError
+
+
+class FakeTransport:
+    """Discografia paginada em memória; /album/{id} sem resposta simula falha do Deezer."""
+
+    def __init__(self, albums, page_size, albums_down=()):
+        self.albums = albums
+        self.page_size = page_size
+        self.albums_down = set(albums_down)
+        self.calls = []
+
+    def get_json(self, endpoint, params=None):
+        self.calls.append(endpoint)
+        if endpoint.startswith('/album/'):
+            if endpoint.split('/')[2] in self.albums_down:
+                raise DeezerAPIError(endpoint)
+            return {'artist': {'name': 'Band'}}
+        index = int(endpoint.split('index=')[1]) if 'index=' in endpoint else 0
+        return {'data': self.albums[index:index + self.page_size], 'total': len(self.albums)}
+
+
+def album(album_id, title, artist='Band'):
+    item = {'id': album_id, 'title': title, 'record_type': 'album', 'nb_tracks': 10}
+    if artist:
+        item['artist'] = {'name': artist}
+    return item
+
+
+def setup(tmp_path, albums, albums_down=()):
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    db.settings.set('ignored_keywords', 'live')
+    client = DeezerDataClient(transport=FakeTransport(albums, 2, albums_down))
+    client.PAGE_SIZE = 2
+    return db, client
+
+
+def sync(db, client):
+    """O mesmo ciclo de check_new_releases/background_add para um artista."""
+    seen = db.seen_album_ids('9')
+    recheck = db.recheck_album_ids('9')
+    before, rejected = set(seen), {}
+    found = [a['deezer_id'] for page in client.iter_discography('9', 'Band', db.settings.album_filter,
+                                                                seen=seen, rejected=rejected, recheck=recheck) for a in page]
+    db.forget_albums_seen('9', recheck)
+    db.mark_albums_seen('9', seen - before, rejected)
+    return found
+
+
+def test_filter_change_only_rechecks_rejected_albums(tmp_path):
+    db, client = setup(tmp_path, [album(1, 'New'), album(2, 'Live One'), album(3, 'Old'), album(4, 'Old Live'),
+                                  album(5, 'Older'), album(6, 'Oldest'), album(7, 'Ancient'), album(8, 'First')])
+    assert sync(db, client) == ['1', '3', '5', '6', '7', '8']
+    assert db.seen_album_ids('9') == {'1', '2', '3', '4', '5', '6', '7', '8'}
+
+    # Nada novo: para na primeira página
+    client.http.calls.clear()
+    assert sync(db, client) == []
+    assert len(client.http.calls) == 1
+
+    db.settings.set('ignored_keywords', 'demo')
+    assert db.seen_album_ids('9') == {'1', '3', '5', '6', '7', '8'}
+    assert db.recheck_album_ids('9') == {'2', '4'}
+
+    # Só os barrados voltam; a paginação passa do último deles e para na primeira página sem novidade
+    client.http.calls.clear()
+    assert sync(db, client) == ['2', '4']
+    assert len(client.http.calls) == 3
+    assert db.recheck_album_ids('9') == set()
+    assert len(db.seen_album_ids('9')) == 8
+
+
+def test_failed_detail_lookup_is_retried(tmp_path):
+    db, client = setup(tmp_path, [album(1, 'New', artist=None), album(2, 'Old')], albums_down={'1'})
+    assert sync(db, client) == ['2']
+    assert db.seen_album_ids('9') == {'2'}
+
+    client.http.albums_down.clear()
+    assert sync(db, client) == ['1']
+    assert db.seen_album_ids('9') == {'1', '2'}
+
+
+def test_rechecked_album_gone_from_deezer_is_forgotten(tmp_path):
+    db, client = setup(tmp_path, [album(1, 'New'), album(2, 'Live One')])
+    sync(db, client)
+    client.http.albums = [album(1, 'New')]
+    db.settings.set('ignored_keywords', 'demo')
+
+    assert sync(db, client) == []
+    assert db.recheck_album_ids('9') == set()
+    assert db.seen_album_ids('9') == {'1'}
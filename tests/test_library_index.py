@@ -0,0 +1,18 @@
+from app.database import Database
+from app.services import library_index
+from app.services.library_index import LibraryIndex
+
+
+def test_first_ensure_fresh_builds_index_on_young_host(tmp_path, monkeypatch):
+    (tmp_path / "music" / "Artist" / "Album").mkdir(parents=True)
+    (tmp_path / "music" / "Artist" / "Album" / "01.mp3").write_bytes(b"x")
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    # Host ligado há 10s: monotonic() bem abaixo de MAX_AGE
+    monkeypatch.setattr(library_index.time, "monotonic", lambda: 10.0)
+
+    library = LibraryIndex(db, root=str(tmp_path / "music"))
+    library.ensure_fresh()
+
+    assert [r['name'] for r in library.artists()] == ["Artist"]
+    assert library.album("Artist", "Album")['track_count'] == 1
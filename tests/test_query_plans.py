@@ -0,0 +1,25 @@
+from app.database import Database
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    assert db.check_query_plans() == []
+
+
+def test_migrated_database_uses_indexes(tmp_path):
+    """Também no banco migrado de verdade (com as estatísticas do ANALYZE)."""
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    conn = db.get_connection()
+    for sql, args in Database.HOT_QUERIES:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", args).fetchall()
+        scans = [row['detail'] for row in plan if row['detail'].startswith('SCAN') and ' USING ' not in row['detail']]
+        assert not scans, (sql, scans)
+
+
+def test_track_status_lookup_uses_composite_index(tmp_path):
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    plan = db.query("EXPLAIN QUERY PLAN SELECT * FROM tracks WHERE queue_id=? AND status='pending'", (0,))
+    assert any('idx_tracks_queue_status' in row['detail'] for row in plan)
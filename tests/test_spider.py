@@ -0,0 +1,19 @@
+from app.database import Database
+from app.services.spider import SpiderService
+
+
+def test_low_fan_candidates_stay_in_frontier(tmp_path):
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    db.execute("INSERT INTO spider_frontier (deezer_id, name, fans, score) VALUES ('7', 'Small Band', 1200, 3.1)")
+    spider = SpiderService(db, None, None)
+
+    db.settings.set('spider_min_fans', '5000')
+    report = spider._consume(1, db.settings)
+    assert report['rejected'] == {SpiderService.LOW_FANS: 1}
+    assert db.query("SELECT status FROM spider_frontier WHERE deezer_id='7'", one=True)['status'] == 'queued'
+
+    # Mínimo mais baixo: o candidato volta a ser avaliado
+    db.settings.set('spider_min_fans', '1000')
+    survivors, verdicts = spider._screen(db.query("SELECT * FROM spider_frontier"), db.settings.get('spider_min_fans'))
+    assert [c['deezer_id'] for c in survivors] == ['7'] and verdicts == {}
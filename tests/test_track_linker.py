@@ -0,0 +1,78 @@
+import struct
+
+from mutagen.flac import FLAC
+
+from app.database import Database
+from app.services.library_index import LibraryIndex
+from app.services.track_linker import TrackLinker
+
+
+def write_flac(path, seconds, **tags):
+    """FLAC mínimo (só STREAMINFO, sem áudio) com comentários Vorbis."""
+    samples = int(seconds * 44100)
+    info = struct.pack('>HH', 4096, 4096) + b'\0' * 6
+    info += ((44100 << 44) | (1 << 41) | (15 << 36) | samples).to_bytes(8, 'big') + b'\0' * 16
+    path.write_bytes(b'fLaC' + bytes([0x80]) + len(info).to_bytes(3, 'big') + info)
+    audio = FLAC(str(path))
+    audio.add_tags()
+    for key, value in tags.items():
+        audio[key] = str(value)
+    audio.save()
+
+
+def setup(tmp_path, tracks):
+    db = Database(str(tmp_path / "melodock.db"))
+    db.init_db()
+    library = LibraryIndex(db, root=str(tmp_path / "music"))
+    album = tmp_path / "music" / "Band" / "Album"
+    album.mkdir(parents=True)
+    qid = db.add_album({'deezer_id': '100', 'title': 'Album'}, 'Band', tracks)
+    return db, TrackLinker(db, library), album, qid
+
+
+def statuses(db, qid):
+    album = db.query("SELECT status FROM queue WHERE id=?", (qid,), one=True)['status']
+    tracks = {r['deezer_id']: (r['status'], r['file_path']) for r in db.query("SELECT * FROM tracks WHERE queue_id=?", (qid,))}
+    return album, tracks
+
+
+def test_link_folder_links_every_track(tmp_path):
+    db, linker, album, qid = setup(tmp_path, [
+        {'deezer_id': '1', 'title': 'Intro', 'track_num': 1, 'duration': 60, 'isrc': 'USAAA0000001'},
+        {'deezer_id': '2', 'title': 'Second Song', 'track_num': 2, 'duration': 200},
+        {'deezer_id': '3', 'title': 'Finale', 'track_num': 3, 'duration': 180},
+    ])
+    write_flac(album / "a.flac", 60, title="Something Else", isrc="usaaa0000001")
+    write_flac(album / "b.flac", 200, title="Unrelated", sourceid="2")
+    write_flac(album / "c.flac", 181, title="Finale (Remastered)", tracknumber=3)
+
+    assert linker.link_folder(qid, "Band", "Album") == (3, 3)
+    status, tracks = statuses(db, qid)
+    assert status == 'completed'
+    assert tracks == {
+        '1': ('completed', str(album / "a.flac")),
+        '2': ('completed', str(album / "b.flac")),
+        '3': ('completed', str(album / "c.flac")),
+    }
+
+
+def test_link_folder_partial_keeps_album_pending(tmp_path):
+    db, linker, album, qid = setup(tmp_path, [
+        {'deezer_id': '1', 'title': 'Intro', 'track_num': 1, 'duration': 60},
+        {'deezer_id': '2', 'title': 'Missing', 'track_num': 2, 'duration': 200},
+    ])
+    write_flac(album / "01.flac", 60, title="Intro", tracknumber=1)
+
+    assert linker.link_folder(qid, "Band", "Album") == (1, 2)
+    status, tracks = statuses(db, qid)
+    assert status == 'pending'
+    assert tracks['1'][0] == 'completed'
+    assert tracks['2'] == ('pending', None)
+
+
+def test_link_folder_without_tags(tmp_path):
+    db, linker, album, qid = setup(tmp_path, [{'deezer_id': '1', 'title': 'Intro', 'track_num': 1}])
+    (album / "01.mp3").write_bytes(b"not audio")
+
+    assert linker.link_folder(qid, "Band", "Album") == (0, 0)
+    assert statuses(db, qid)[0] == 'pending'